@@ -0,0 +1,110 @@
+#!/usr/local/bin/python3
+
+""" Point-in-time index over the report dates of a universe of tickers.
+
+    Answers "which is the latest quarter at or before this month" for one
+    ticker in O(log n) (bisect), or for a vector of months across the whole
+    universe at once (searchsorted).  The number of consecutive quarters (3
+    months apart) ending at each quarter is precomputed, so checking that a
+    k-quarter window is quarterly is a single lookup.
+
+    Dates are month ordinals (see utils.month_ordinal).  Each ticker's dates
+    are packed to the left of a tickers x L array in ascending order, padded
+    with PAD, which is larger than any real date.
+"""
+
+import numpy as np
+import utils
+from bisect import bisect_right
+
+PAD = np.iinfo(np.int32).max
+
+# Returns, for each packed position, the number of consecutive quarters (3
+# months apart) ending at it.
+def run_lengths(ordinals):
+  width = ordinals.shape[1]
+  index = np.broadcast_to(np.arange(width), ordinals.shape)
+  starts = np.ones(ordinals.shape, dtype=bool)
+  starts[:, 1:] = (ordinals[:, 1:] - ordinals[:, :-1]) != 3
+  last_start = np.maximum.accumulate(np.where(starts, index, 0), axis=1)
+  return index - last_start + 1
+
+class AsOfIndex:
+  def __init__(self, ordinals, counts, columns=None):
+    """ ordinals: tickers x L packed month ordinals.
+        counts: number of dates per ticker.
+        columns: optional tickers x L indexes of the dates into a shared
+                 quarter index (see from_reported), 0 for padding.
+    """
+    self.ordinals = np.asarray(ordinals, dtype=np.int64)
+    self.counts = np.asarray(counts)
+    self.columns = columns
+    self.runs = run_lengths(self.ordinals)
+    self.lists = None
+
+  @staticmethod
+  def from_reported(reported, quarters):
+    """ Builds the index from a tickers x quarters reported mask and the
+        month ordinals of the quarters, as in fundamentals_store.
+    """
+    reported = np.asarray(reported)
+    quarters = np.asarray(quarters)
+    counts = reported.sum(axis=1)
+    width = max(1, int(counts.max()) if len(counts) > 0 else 1)
+    # A stable sort of the negated mask moves reported columns first while
+    # keeping them in date order.
+    order = np.argsort(~reported, axis=1, kind='stable')[:, :width]
+    valid = np.arange(width)[None, :] < counts[:, None]
+    columns = np.where(valid, order, 0)
+    ordinals = np.where(valid, quarters[columns], PAD)
+    return AsOfIndex(ordinals, counts, columns)
+
+  @staticmethod
+  def from_dates(date_lists):
+    """ Builds the index from one ascending list of yyyy-mm dates per
+        ticker.  Raises ValueError if a list is not ascending.
+    """
+    counts = [len(dates) for dates in date_lists]
+    width = max([1] + counts)
+    ordinals = np.full((len(date_lists), width), PAD, dtype=np.int64)
+    for i, dates in enumerate(date_lists):
+      row = [utils.month_ordinal(d) for d in dates]
+      if row != sorted(row):
+        raise ValueError('dates are not in ascending order: %s'
+                         % ','.join(dates))
+      ordinals[i, :len(row)] = row
+    return AsOfIndex(ordinals, counts)
+
+  def size(self):
+    return self.ordinals.shape[0]
+
+  # Returns the position of the latest date at or before month for ticker
+  # index t, or -1 if there is none.
+  def latest(self, t, month):
+    if self.lists is None:
+      self.lists = [self.ordinals[i, :self.counts[i]].tolist()
+                    for i in range(self.size())]
+    return bisect_right(self.lists[t], month) - 1
+
+  # Returns the tickers x months positions of the latest dates at or before
+  # each month, -1 where there is none.
+  def latest_batch(self, months):
+    n, width = self.ordinals.shape
+    months = np.asarray(months, dtype=np.int64)
+    # Offset each ticker's (sorted) dates into its own range, so that a single
+    # searchsorted over the flattened array serves every ticker.
+    stride = np.int64(PAD) + 1
+    offsets = np.arange(n, dtype=np.int64)[:, None] * stride
+    keys = (self.ordinals + offsets).ravel()
+    queries = (months[None, :] + offsets).ravel()
+    found = np.searchsorted(keys, queries, side='right').reshape(n, len(months))
+    return found - np.arange(n)[:, None] * width - 1
+
+  # Returns the month ordinal at a position (or positions).
+  def date(self, t, position):
+    return self.ordinals[t, position]
+
+  # Returns the number of consecutive quarters ending at a position (or
+  # positions).
+  def run_length(self, t, position):
+    return self.runs[t, position]
@@ -0,0 +1,185 @@
+#!/usr/local/bin/python3
+
+""" Walk-forward backtest over a range of months.
+
+    For every month, computes the factors (see factor_panel.py), scores,
+    filters them as haugen_filter.py does, and measures the filtered scores
+    against the price returns over each horizon, as haugen_measure_error.py
+    does.  Months are split into blocks that are evaluated by a pool of
+    worker processes.  The inputs are loaded once before the pool starts;
+    workers inherit them (price samples copy-on-write, the fundamentals
+    store and the volume cube as shared memory maps), or load them if the
+    platform does not fork.
+
+    Scores use the table 1 weights, or with --weights_path the weight set
+    named after each month (as written by payoff_regression.py), or the set
+    named --weight_set for every month.
+
+    Writes one line per month and horizon:
+    yyyy_mm horizon tickers up_predicted up_actual correct top_decile
+    bottom_decile spread pearson_ic spearman_ic
+    where returns are means over the filtered tickers, spread is
+    top_decile - bottom_decile, and the rest are measured as in
+    haugen_measure_error.evaluate().  Months or horizons without data are
+    skipped.
+"""
+
+import argparse
+import factor_engine
+import factor_panel
+import haugen_measure_error
+import logging
+import numpy as np
+import utils
+from concurrent.futures import ProcessPoolExecutor
+
+K = haugen_measure_error.K
+PRICE_BONUS = haugen_measure_error.PRICE_BONUS
+
+HEADER = ('yyyy_mm horizon tickers up_predicted up_actual correct top_decile'
+          ' bottom_decile spread pearson_ic spearman_ic')
+
+# Inputs shared with the workers.  Set before the pool starts, so forked
+# workers inherit them.
+inputs = None
+
+def init_worker(input_args):
+  global inputs
+  if inputs is None:
+    inputs = factor_panel.Inputs(*input_args)
+
+# Computes the result lines of a block of months.  weights is months x
+# SCORE_FACTORS, NaN for months without weights.
+def run_block(task):
+  months, weights, horizons = task
+  months = np.asarray(months, dtype=np.int64)
+  panel = factor_panel.build(inputs, months)
+  x, valid = panel.stack(factor_engine.SCORE_FACTORS)
+  scores = np.einsum('tmf,mf->tm', np.where(valid[:, :, None], x, 0.0),
+                     np.nan_to_num(weights)) / 100  # accounting for %
+  price, price_ok = panel.factors['price']
+  mc, mc_ok = panel.factors['mc']
+  keep = valid & price_ok & mc_ok
+  keep &= np.where(price_ok, price, 0.0) >= factor_engine.MIN_PRICE
+  keep &= np.where(mc_ok, mc, 0.0) >= factor_engine.MIN_MC
+
+  futures = [inputs.matrix.lookup(months + h) for h in horizons]
+  lines = []
+  for j in range(len(months)):
+    if np.isnan(weights[j]).any():
+      continue
+    future = np.stack([f[:, j] for f in futures])
+    valid = keep[None, :, j] & ~np.isnan(future)
+    current = price[:, j][None, :]
+    with np.errstate(invalid='ignore'):
+      returns = np.where(valid, (future - current) / (current + PRICE_BONUS),
+                         0.0)
+    results = haugen_measure_error.evaluate(scores[:, j], returns, valid)
+    for i in range(len(horizons)):
+      if results['tickers'][i] < K:
+        continue
+      top, bottom = results['deciles'][i][K - 1], results['deciles'][i][0]
+      lines.append('%s %d %d %d %d %d %f %f %f %f %f' % (
+          utils.month_string(months[j]), horizons[i], results['tickers'][i],
+          results['up_predicted'][i], results['up_actual'][i],
+          results['correct'][i], top, bottom, top - bottom,
+          results['pearson_ic'][i], results['spearman_ic'][i]))
+  return lines
+
+# Weights of every month: months x SCORE_FACTORS, NaN where there is none.
+def month_weights(months, weights_path, weight_set):
+  if weights_path == '':
+    return np.tile(np.array(factor_engine.SCORE_WEIGHTS), (len(months), 1))
+  names, weights = factor_engine.read_weights(weights_path)
+  index = {n: i for i, n in enumerate(names)}
+  output = np.full((len(months), len(factor_engine.SCORE_FACTORS)), np.nan)
+  for j in range(len(months)):
+    name = weight_set if weight_set != '' else utils.month_string(months[j])
+    if name in index:
+      output[j] = weights[index[name]]
+    else:
+      logging.warning('No weight set for %s' % utils.month_string(months[j]))
+  return output
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--ticker_file', required=True)
+  parser.add_argument('--price_sample_dir', required=True)
+  parser.add_argument('--market_sample_path', required=True)
+  # Built by fundamentals_store.py and volume_cube.py.
+  parser.add_argument('--store_dir', required=True)
+  parser.add_argument('--cube_dir', required=True)
+  # Inclusive range of months.
+  parser.add_argument('--from_yyyy_mm', required=True)
+  parser.add_argument('--to_yyyy_mm', required=True)
+  # Horizons in months, separated by commas.
+  parser.add_argument('--horizons', default='1,2,3,4,6,12')
+  parser.add_argument('--weights_path', default='')
+  parser.add_argument('--weight_set', default='')
+  parser.add_argument('--workers', default='1')
+  parser.add_argument('--output_path', required=True)
+  parser.add_argument('--verbose', action='store_true')
+  args = parser.parse_args()
+
+  utils.setup_logging(args.verbose)
+  workers = int(args.workers)
+  assert workers > 0
+
+  # Tickers are listed one per line.
+  with open(args.ticker_file, 'r') as fp:
+    tickers = fp.read().splitlines()
+  logging.info('Processing %d tickers' % len(tickers))
+
+  first = utils.month_ordinal(args.from_yyyy_mm)
+  last = utils.month_ordinal(args.to_yyyy_mm)
+  assert first <= last
+  months = np.arange(first, last + 1)
+  horizons = [int(h) for h in args.horizons.split(',')]
+  for h in horizons:
+    assert h > 0
+
+  input_args = (tickers, args.price_sample_dir, args.market_sample_path,
+                args.store_dir, args.cube_dir)
+  init_worker(input_args)
+  # Excess returns need market samples at each month and at every horizon
+  # of factor_engine.ER_HORIZONS before it.
+  needed = months[:, None] - np.array((0,) + factor_engine.ER_HORIZONS)
+  has_market = ~np.isnan(
+      inputs.market.lookup(needed.ravel())[0]).reshape(needed.shape).any(axis=1)
+  if not has_market.all():
+    logging.warning('Skipping %d months without market samples: %s'
+                    % (np.count_nonzero(~has_market),
+                       ' '.join(utils.month_string(m)
+                                for m in months[~has_market])))
+  months = months[has_market]
+  weights = month_weights(months, args.weights_path, args.weight_set)
+  # A few blocks per worker balance the load; months within a block are
+  # computed as arrays.
+  blocks = np.array_split(np.arange(len(months)),
+                          max(1, min(len(months), workers * 4)))
+  blocks = [b for b in blocks if len(b) > 0]
+  tasks = [(months[b], weights[b], horizons) for b in blocks]
+  if workers > 1:
+    executor = ProcessPoolExecutor(max_workers=workers,
+                                   initializer=init_worker,
+                                   initargs=(input_args,))
+    results = executor.map(run_block, tasks)
+  else:
+    executor = None
+    results = map(run_block, tasks)
+  lines = []
+  for block_lines in results:
+    lines.extend(block_lines)
+  if executor is not None:
+    executor.shutdown()
+
+  # Sorted by horizon, then month.
+  lines.sort(key=lambda line: (int(line.split(' ')[1]), line.split(' ')[0]))
+  with open(args.output_path, 'w') as fp:
+    print(HEADER, file=fp)
+    for line in lines:
+      print(line, file=fp)
+  logging.info('Wrote %d results for %d months' % (len(lines), len(months)))
+
+if __name__ == '__main__':
+  main()
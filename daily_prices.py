@@ -0,0 +1,78 @@
+#!/usr/local/bin/python3
+
+""" Reads daily price files.
+
+    A daily price file has a header line followed by one
+    "date,open,high,low,close,volume,adjclose" line per trading day, newest
+    first.  Dates are yyyy-mm-dd.
+"""
+
+import mmap
+import utils
+
+# Returns the start of the first line at or after pos.
+def next_line_start(mm, pos, first):
+  if pos <= first:
+    return first
+  return mm.find(b'\n', pos - 1) + 1 or len(mm)
+
+# Returns the start of the line after the one starting at pos.
+def following_line_start(mm, pos):
+  return mm.find(b'\n', pos) + 1 or len(mm)
+
+# Returns the rows of the k months ending at yyyy_mm, newest first, each row
+# split into its fields.
+#
+# The file is memory-mapped and the first row at or before yyyy_mm is found
+# by binary search over byte offsets, so only the rows in the window are
+# read and parsed.
+def read_trailing_rows(input_path, yyyy_mm, k):
+  target = utils.month_ordinal(yyyy_mm)
+  with open(input_path, 'rb') as fp:
+    size = fp.seek(0, 2)
+    assert size > 0, 'Empty price file: %s' % input_path
+    with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+      first = following_line_start(mm, 0)  # skip the header
+
+      # Month ordinal of the line starting at pos.
+      def month_at(pos):
+        return utils.month_ordinal(mm[pos:pos+7].decode('ascii'))
+
+      # Rows are newest first, so "month <= target" is false for a prefix of
+      # the lines and true for the rest.  Find the first line where it is
+      # true: lo and hi are line starts, lines before lo are newer than the
+      # target, and hi is a matching line or the end of the file.
+      lo, hi = first, size
+      while lo < hi:
+        s = next_line_start(mm, (lo + hi) // 2, first)
+        if s >= hi:
+          s = lo
+        if mm[s:s+1] in (b'\n', b'\r') or month_at(s) > target:
+          lo = following_line_start(mm, s)
+        else:
+          hi = s
+
+      rows = []
+      pos = lo
+      while pos < size:
+        end = following_line_start(mm, pos)
+        line = mm[pos:end].decode('ascii').rstrip('\r\n')
+        pos = end
+        if line == '':
+          continue
+        if target - utils.month_ordinal(line[:7]) >= k:
+          break
+        rows.append(line.split(','))
+  return rows
+
+# Returns all rows of a daily price file, newest first, each row split into
+# its fields.
+def read_rows(input_path):
+  rows = []
+  with open(input_path, 'r') as fp:
+    fp.readline()  # header
+    for line in fp:
+      line = line.rstrip('\r\n')
+      if line != '':
+        rows.append(line.split(','))
+  return rows
@@ -2,30 +2,278 @@
 
 """ Downloads financial data (income statements, balance sheets and cash flow
     statements) from morningstar.com.
+
+    Downloads run in-process on a bounded pool of worker threads.  Each worker
+    keeps its own keep-alive HTTP connection, so a full refresh does not pay
+    for one process spawn and one TCP handshake per ticker.  Requests are
+    paced by download_scheduler, which rate-limits them, adapts concurrency
+    to the server and retries transient failures with backoff.  Point
+    --url_prefix to a local HTTP server serving canned csv files for testing.
 """
 
 import argparse
+import download_scheduler
+import hashlib
 import logging
+import parse_income_statements
+import queue
+import statement_parser
+import threading
+import time
+import traceback
 import utils
-from os import path, remove, stat, system
-
-WGET = '/usr/local/bin/wget'
-
-def download(ticker, report_type, period, output_path):
-  url = ('http://financials.morningstar.com/ajax/ReportProcess4CSV.html'
-         '?t=%s&region=usa&culture=en-US&cur=USD&reportType=%s&period=%s'
-         '&dataType=A&order=asc&columnYear=5&rounding=1&view=raw'
-         '&denominatorView=raw&number=1' % (ticker, report_type, period))
-  cmd = '%s -q "%s" -O %s' % (WGET, url, output_path)
-  if system(cmd) != 0:
-    logging.warning('Download failed for %s: %s' % (ticker, url))
-    if path.isfile(output_path):
-      remove(output_path)
-    return False
-  if stat(output_path).st_size <= 0:
+import validate_financial_data
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from os import path, rename
+from urllib.parse import urlsplit
+
+URL_PREFIX = 'http://financials.morningstar.com'
+URL_PATH = ('/ajax/ReportProcess4CSV.html'
+            '?t=%s&region=usa&culture=en-US&cur=USD&reportType=%s&period=%s'
+            '&dataType=A&order=asc&columnYear=5&rounding=1&view=raw'
+            '&denominatorView=raw&number=1')
+WORKERS = 8
+RATE = 10.0  # requests per second per host
+MAX_RETRIES = 5
+TIMEOUT = 60  # seconds
+# Statuses that mean the server wants us to back off.
+THROTTLE_STATUSES = {429, 503}
+
+# Tickers skipped by the parse_* scripts.
+SKIPPED_TICKERS = {
+    'is': parse_income_statements.SKIPPED_TICKERS,
+    'bs': set(),
+    'cf': set(),
+}
+
+class Fetcher:
+  """ Issues GET requests over one keep-alive connection per thread.
+  """
+  def __init__(self, url_prefix, timeout=TIMEOUT):
+    parts = urlsplit(url_prefix)
+    assert parts.scheme in ('http', 'https'), (
+        'unsupported url prefix: %s' % url_prefix)
+    self.url_prefix = url_prefix.rstrip('/')
+    self.scheme = parts.scheme
+    self.netloc = parts.netloc
+    self.timeout = timeout
+    self.local = threading.local()
+    self.lock = threading.Lock()
+    self.connections = []
+
+  def connection(self):
+    conn = getattr(self.local, 'conn', None)
+    if conn is None:
+      if self.scheme == 'https':
+        conn = HTTPSConnection(self.netloc, timeout=self.timeout)
+      else:
+        conn = HTTPConnection(self.netloc, timeout=self.timeout)
+      self.local.conn = conn
+      with self.lock:
+        self.connections.append(conn)
+    return conn
+
+  def reset(self):
+    conn = getattr(self.local, 'conn', None)
+    if conn is not None:
+      conn.close()
+      with self.lock:
+        if conn in self.connections:
+          self.connections.remove(conn)
+    self.local.conn = None
+
+  # Returns (status, headers, body).
+  def get(self, url_path, headers=None):
+    # The server may close an idle keep-alive connection at any time, so a
+    # failed request is retried once over a fresh connection.
+    for attempt in range(2):
+      conn = self.connection()
+      try:
+        conn.request('GET', url_path, headers=headers or dict())
+        response = conn.getresponse()
+        body = response.read()
+        if response.will_close:
+          self.reset()
+        return response.status, response.headers, body
+      except (HTTPException, OSError):
+        self.reset()
+        if attempt > 0:
+          raise
+
+  def close(self):
+    with self.lock:
+      for conn in self.connections:
+        conn.close()
+      self.connections = []
+
+def get_url_path(ticker, report_type, period):
+  return URL_PATH % (ticker, report_type, period)
+
+# The manifest records one line per downloaded report with tab-separated
+# fields: ticker, report type, period, sha1 of the content, fetch time (unix
+# seconds) and the ETag and Last-Modified validators returned by the server
+# (empty if none).  It is used to issue conditional requests and to tell
+# which reports actually changed since the last refresh.
+MANIFEST_FIELDS = ('ticker', 'report_type', 'period', 'sha1', 'fetch_time',
+                   'etag', 'last_modified')
+
+def read_manifest(manifest_path):
+  manifest = dict()
+  if not path.isfile(manifest_path):
+    return manifest
+  with open(manifest_path, 'r') as fp:
+    lines = fp.read().splitlines()
+  for line in lines:
+    items = line.split('\t')
+    assert len(items) == len(MANIFEST_FIELDS), line
+    entry = dict(zip(MANIFEST_FIELDS, items))
+    manifest[(entry['ticker'], entry['report_type'], entry['period'])] = entry
+  return manifest
+
+def write_manifest(manifest, manifest_path):
+  tmp_path = '%s.tmp' % manifest_path
+  with open(tmp_path, 'w') as fp:
+    for key in sorted(manifest.keys()):
+      entry = manifest[key]
+      print('\t'.join([entry[f] for f in MANIFEST_FIELDS]), file=fp)
+  rename(tmp_path, manifest_path)
+
+def file_sha1(file_path):
+  with open(file_path, 'rb') as fp:
+    return hashlib.sha1(fp.read()).hexdigest()
+
+# Downloads one report into output_path, or only into memory if output_path
+# is None.  old_sha1 is the hash of the current content, if any.  If entry is
+# the manifest entry of that content, its validators are sent as a
+# conditional request.  The content is only written if it changed.
+#
+# Returns (state, result) as expected by download_scheduler, where result is
+# (size, body, new_entry), size is the number of bytes downloaded and body is
+# None if the content did not change.
+def download(fetcher, ticker, report_type, period, output_path, entry=None,
+             old_sha1=None):
+  url_path = get_url_path(ticker, report_type, period)
+  url = fetcher.url_prefix + url_path
+  headers = dict()
+  # Validators are only trusted if the content is still what was downloaded.
+  if entry is not None and entry['sha1'] == old_sha1:
+    if entry['etag']:
+      headers['If-None-Match'] = entry['etag']
+    if entry['last_modified']:
+      headers['If-Modified-Since'] = entry['last_modified']
+  try:
+    status, response_headers, body = fetcher.get(url_path, headers)
+  except (HTTPException, OSError) as e:
+    logging.warning('Download failed for %s: %s (%s)' % (ticker, url, e))
+    return download_scheduler.RETRY, None
+  if status in THROTTLE_STATUSES:
+    logging.debug('Throttled for %s: %s (status %d)' % (ticker, url, status))
+    return download_scheduler.THROTTLED, None
+  if status == 304 and headers:
+    logging.debug('Not modified: %s' % ticker)
+    new_entry = dict(entry)
+    new_entry['fetch_time'] = '%d' % time.time()
+    return download_scheduler.OK, (0, None, new_entry)
+  if status != 200:
+    logging.warning('Download failed for %s: %s (status %d)'
+                    % (ticker, url, status))
+    if status >= 500:
+      return download_scheduler.RETRY, None
+    return download_scheduler.FAIL, None
+  if len(body) <= 0:
     logging.warning('Empty downloaded file for %s: %s' % (ticker, url))
-    remove(output_path)
+    return download_scheduler.FAIL, None
+  new_entry = {
+      'ticker': ticker,
+      'report_type': report_type,
+      'period': period,
+      'sha1': hashlib.sha1(body).hexdigest(),
+      'fetch_time': '%d' % time.time(),
+      'etag': response_headers.get('ETag', ''),
+      'last_modified': response_headers.get('Last-Modified', ''),
+  }
+  if old_sha1 == new_entry['sha1']:
+    logging.debug('Unchanged content: %s' % ticker)
+    return download_scheduler.OK, (len(body), None, new_entry)
+  if output_path is not None:
+    write_atomically(body, output_path)
+  return download_scheduler.OK, (len(body), body, new_entry)
+
+# Writes to a temporary file first so that a partial write never shows up as
+# a valid output file.
+def write_atomically(data, output_path):
+  tmp_path = '%s.tmp' % output_path
+  with open(tmp_path, 'wb') as fp:
+    fp.write(data)
+  rename(tmp_path, output_path)
+
+# Runs the scheduler on a background thread and yields
+# (ticker, state, result, attempts) as downloads finish, so that the consumer
+# can process one report while the others are still downloading.  Closing
+# the generator early stops the scheduler and waits for it.
+def iter_downloads(scheduler, jobs):
+  done = queue.Queue()
+  errors = []
+  stop = threading.Event()
+  def run():
+    try:
+      scheduler.run(jobs, lambda *item: done.put(item), stop)
+    except Exception as e:
+      errors.append(e)
+    finally:
+      done.put(None)
+  thread = threading.Thread(target=run)
+  thread.start()
+  try:
+    while True:
+      item = done.get()
+      if item is None:
+        break
+      yield item
+  finally:
+    stop.set()
+    thread.join()
+  if errors:
+    raise errors[0]
+
+# Describes an exception and where it was raised, as
+# statement_parser.parse_tickers does; bare asserts carry no message.
+def describe_error(e):
+  frame = traceback.extract_tb(e.__traceback__)[-1]
+  return '%s(%s) at %s:%d' % (type(e).__name__, e,
+                              path.basename(frame.filename), frame.lineno)
+
+# Validates and parses a downloaded report in memory, and writes the parsed
+# output to parsed_path.  Returns False if the report was rejected.  Any
+# error in a report only rejects that report.
+def parse_report(ticker, report_type, body, parsed_path):
+  try:
+    report = statement_parser.tokenize(body.decode('utf-8').splitlines())
+  except Exception as e:
+    logging.warning('Tokenizing failed for %s: %s'
+                    % (ticker, describe_error(e)))
+    return False
+  if ticker not in validate_financial_data.SKIPPED_TICKERS:
+    req_map, opt_map, add_map, skip_map = (
+        validate_financial_data.TYPE_MAP[report_type])
+    try:
+      statement_parser.validate(
+          report, ticker, req_map, opt_map, add_map, skip_map)
+    except Exception as e:
+      logging.warning('Validation failed for %s: %s'
+                      % (ticker, describe_error(e)))
+      return False
+  if ticker in SKIPPED_TICKERS[report_type]:
+    logging.warning('Parsing skipped for %s' % ticker)
     return False
+  try:
+    output = statement_parser.extract(
+        report, statement_parser.SCHEMAS[report_type])
+  except Exception as e:
+    logging.warning('Parsing failed for %s: %s' % (ticker, describe_error(e)))
+    return False
+  write_atomically(''.join(['%s\n' % line for line in output]).encode('utf-8'),
+                   parsed_path)
   return True
 
 def main():
@@ -33,8 +281,25 @@ def main():
   parser.add_argument('--ticker_file', required=True)
   parser.add_argument('--report_type', required=True)
   parser.add_argument('--period', required=True)
-  parser.add_argument('--output_dir', required=True)
+  # Raw reports are written here.  In pipeline mode this is optional and
+  # serves as an archive of the raw reports.
+  parser.add_argument('--output_dir', default='')
+  # Pipeline mode: if set, reports are validated and parsed in memory as
+  # they are downloaded, and the parsed output is written here.
+  parser.add_argument('--parsed_output_dir', default='')
   parser.add_argument('--overwrite', action='store_true')
+  # Defaults to MANIFEST under --output_dir, or under --parsed_output_dir if
+  # raw reports are not kept.
+  parser.add_argument('--manifest_path', default='')
+  # If set, tickers whose report changed are written here, one per line.
+  parser.add_argument('--changed_ticker_file', default='')
+  parser.add_argument('--workers', default=str(WORKERS))
+  # Per-host limits: concurrent requests, requests per second, and retries
+  # of throttled or transiently failed downloads.
+  parser.add_argument('--per_host', default=str(WORKERS))
+  parser.add_argument('--rate', default=str(RATE))
+  parser.add_argument('--max_retries', default=str(MAX_RETRIES))
+  parser.add_argument('--url_prefix', default=URL_PREFIX)
   parser.add_argument('--verbose', action='store_true')
   args = parser.parse_args()
 
@@ -45,37 +310,130 @@ def main():
       'report_type must be one of "is", "bs" and "cf"')
   p = args.period
   assert p == '3' or p == '12', 'period must be "3" or "12"'
+  workers = int(args.workers)
+  assert workers > 0
+  pipeline = args.parsed_output_dir != ''
+  assert args.output_dir != '' or pipeline, (
+      'at least one of --output_dir and --parsed_output_dir is required')
+
+  # Raw reports, or None if they are not kept.
+  def get_raw_path(ticker):
+    if args.output_dir == '':
+      return None
+    return '%s/%s.csv' % (args.output_dir, ticker)
+  # Existing target files are skipped unless --overwrite is set.
+  def get_target_path(ticker):
+    if pipeline:
+      return '%s/%s.csv' % (args.parsed_output_dir, ticker)
+    return get_raw_path(ticker)
 
   # Tickers are listed one per line.
   with open(args.ticker_file, 'r') as fp:
     tickers = fp.read().splitlines()
   logging.info('Processing %d tickers' % len(tickers))
 
-  sl, fl = [], []  # Lists of tickers succeeded/failed to download.
-  for i in range(len(tickers)):
-    ticker = tickers[i]
-    logging.info('%d/%d: %s' % (i+1, len(tickers), ticker))
-
-    output_path = '%s/%s.csv' % (args.output_dir, ticker)
-    dl = False
+  dl_tickers = []
+  for ticker in tickers:
+    output_path = get_target_path(ticker)
     if path.isfile(output_path):
       action = 'skipping'
       if args.overwrite:
-        remove(output_path)
-        action = 'overwriting'
-        dl = True
+        # The file is replaced only if the downloaded content differs.
+        action = 'overwriting if changed'
+        dl_tickers.append(ticker)
       logging.warning('Output file exists: %s, %s' % (output_path, action))
-    else: dl = True
+    else: dl_tickers.append(ticker)
+  logging.info('Downloading %d tickers with %d workers'
+               % (len(dl_tickers), workers))
+
+  manifest_path = args.manifest_path
+  if manifest_path == '':
+    manifest_path = '%s/MANIFEST' % (args.output_dir or args.parsed_output_dir)
+  manifest = read_manifest(manifest_path)
+  logging.info('Loaded %d manifest entries' % len(manifest))
+
+  # Hash of the content the target file was produced from, if any.
+  def get_old_sha1(ticker, entry):
+    if not path.isfile(get_target_path(ticker)):
+      return None
+    raw_path = get_raw_path(ticker)
+    if pipeline or raw_path is None:
+      # The manifest records what the parsed file was produced from (the
+      # raw archive may be newer if parsing failed), and without a raw
+      # archive it is the only record.
+      return entry['sha1'] if entry is not None else None
+    if not path.isfile(raw_path):
+      return None
+    return file_sha1(raw_path)
+
+  fetcher = Fetcher(args.url_prefix)
+  host = urlsplit(args.url_prefix).netloc
+  def download_job(ticker):
+    entry = manifest.get((ticker, rt, p))
+    return lambda: download(fetcher, ticker, rt, p, get_raw_path(ticker),
+                            entry, get_old_sha1(ticker, entry))
+  jobs = [(ticker, host, download_job(ticker)) for ticker in dl_tickers]
+
+  scheduler = download_scheduler.Scheduler(
+      workers, int(args.per_host), float(args.rate),
+      max_retries=int(args.max_retries))
+  sl, fl = set(), set()  # Sets of tickers succeeded/failed to download.
+  cl = set()  # Set of tickers whose report changed.
+  pl = set()  # Set of tickers rejected by validation or parsing.
+  total_bytes = 0
+  start = time.time()
+  downloads = iter_downloads(scheduler, jobs)
+  # Whatever happens, the downloads are stopped and the manifest keeps the
+  # entries of the reports processed so far.
+  try:
+    for i, (ticker, state, result, attempts) in enumerate(downloads):
+      logging.info('%d/%d: %s (%s after %d attempts)'
+                   % (i+1, len(dl_tickers), ticker, state, attempts))
+      if state != download_scheduler.OK:
+        fl.add(ticker)
+        continue
+      size, body, entry = result
+      sl.add(ticker)
+      total_bytes += size
+      if body is not None:
+        cl.add(ticker)
+        if pipeline:
+          parsed_path = '%s/%s.csv' % (args.parsed_output_dir, ticker)
+          if not parse_report(ticker, rt, body, parsed_path):
+            # The old entry is kept, so the report is parsed again next
+            # time.
+            pl.add(ticker)
+            continue
+      manifest[(ticker, rt, p)] = entry
+  finally:
+    downloads.close()
+    fetcher.close()
+    write_manifest(manifest, manifest_path)
+  elapsed = max(time.time() - start, 1e-6)
+
+  # Report in ticker file order.
+  sl = [t for t in dl_tickers if t in sl]
+  fl = [t for t in dl_tickers if t in fl]
+  cl = [t for t in dl_tickers if t in cl]
+  pl = [t for t in dl_tickers if t in pl]
+  if args.changed_ticker_file != '':
+    with open(args.changed_ticker_file, 'w') as fp:
+      for ticker in cl:
+        print(ticker, file=fp)
 
-    if dl:
-      ok = download(ticker, rt, p, output_path)
-      if ok: sl.append(ticker)
-      else: fl.append(ticker)
   logging.info('Downloaded %d tickers, failed %d tickers'
                % (len(sl), len(fl)))
+  logging.info('Throughput: %.2f tickers/s, %.1f KB/s (%d bytes in %.1fs)'
+               % (len(dl_tickers) / elapsed, total_bytes / 1024 / elapsed,
+                  total_bytes, elapsed))
+  logging.info('Changed %d tickers, unchanged %d tickers'
+               % (len(cl), len(sl) - len(cl)))
+  if pipeline:
+    logging.info('Parsed %d tickers, rejected %d tickers'
+                 % (len(cl) - len(pl), len(pl)))
+    logging.info('Rejected tickers: %s' % pl)
   logging.info('Downloaded tickers: %s' % sl)
   logging.info('Failed tickers: %s' % fl)
 
 if __name__ == '__main__':
   main()
-
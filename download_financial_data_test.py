@@ -0,0 +1,107 @@
+#!/usr/local/bin/python3
+
+""" Tests Fetcher and download() of download_financial_data.py against a
+    local http.server standing in for morningstar.com.
+
+    Run: python3 -m unittest download_financial_data_test
+"""
+
+import download_financial_data
+import download_scheduler
+import hashlib
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import listdir, path
+
+BODY = b'header\n1,2,3\n'
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'  # keep-alive
+
+  def do_GET(self):
+    server = self.server
+    with server.lock:
+      server.ports.append(self.client_address[1])
+      drop = server.drop_after_response
+      server.drop_after_response = False
+    self.send_response(200)
+    self.send_header('Content-Length', str(len(BODY)))
+    self.send_header('ETag', '"v1"')
+    self.end_headers()
+    self.wfile.write(BODY)
+    # Closes the connection without telling the client, as a server does
+    # when an idle keep-alive connection times out.
+    if drop:
+      self.close_connection = True
+
+  def log_message(self, format, *args):
+    pass
+
+class FetcherTest(unittest.TestCase):
+  def setUp(self):
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    self.server.lock = threading.Lock()
+    self.server.ports = []
+    self.server.drop_after_response = False
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.start()
+    self.fetcher = download_financial_data.Fetcher(
+        'http://127.0.0.1:%d' % self.server.server_address[1], timeout=5)
+    self.tmp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    self.fetcher.close()
+    self.server.shutdown()
+    self.server.server_close()
+    self.thread.join()
+    shutil.rmtree(self.tmp_dir)
+
+  def test_reuses_connection(self):
+    for _ in range(3):
+      status, _, body = self.fetcher.get('/report')
+      self.assertEqual(status, 200)
+      self.assertEqual(body, BODY)
+    # All requests came from the same client port.
+    self.assertEqual(len(set(self.server.ports)), 1)
+    self.assertEqual(len(self.fetcher.connections), 1)
+
+  def test_retries_stale_connection(self):
+    self.server.drop_after_response = True
+    self.fetcher.get('/report')
+    status, _, body = self.fetcher.get('/report')
+    self.assertEqual(status, 200)
+    self.assertEqual(body, BODY)
+    # The second request went over a fresh connection, and the closed one
+    # was dropped.
+    self.assertEqual(len(set(self.server.ports)), 2)
+    self.assertEqual(len(self.fetcher.connections), 1)
+
+  def test_writes_atomically(self):
+    output_path = '%s/T.csv' % self.tmp_dir
+    with open(output_path, 'wb') as fp:
+      fp.write(b'old\n')
+    state, (size, body, entry) = download_financial_data.download(
+        self.fetcher, 'T', 'is', '3', output_path,
+        old_sha1=download_financial_data.file_sha1(output_path))
+    self.assertEqual(state, download_scheduler.OK)
+    self.assertEqual((size, body), (len(BODY), BODY))
+    self.assertEqual(entry['etag'], '"v1"')
+    with open(output_path, 'rb') as fp:
+      self.assertEqual(fp.read(), BODY)
+    # The temporary file was renamed over the output.
+    self.assertEqual(listdir(self.tmp_dir), ['T.csv'])
+
+  def test_skips_unchanged_content(self):
+    output_path = '%s/T.csv' % self.tmp_dir
+    state, (size, body, entry) = download_financial_data.download(
+        self.fetcher, 'T', 'is', '3', output_path,
+        old_sha1=hashlib.sha1(BODY).hexdigest())
+    self.assertEqual(state, download_scheduler.OK)
+    self.assertIsNone(body)
+    self.assertFalse(path.exists(output_path))
+
+if __name__ == '__main__':
+  unittest.main()
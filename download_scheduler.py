@@ -0,0 +1,199 @@
+#!/usr/local/bin/python3
+
+""" Schedules download jobs against rate-limited hosts.
+
+    Each host gets a token bucket (requests per second with a burst allowance)
+    and an adaptive concurrency limit.  The limit grows by one after a window
+    of fast successful requests and is halved on throttling or failure, so
+    concurrency settles at what the server tolerates.  Failed jobs are put on
+    a retry queue with exponential backoff and full jitter instead of being
+    dropped.
+
+    A job is a (key, host, fn) tuple.  fn() is called on a worker thread and
+    returns (state, value), where state is one of OK, RETRY, THROTTLED and
+    FAIL.  RETRY and THROTTLED jobs are retried up to max_retries times.
+"""
+
+import heapq
+import logging
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+OK = 'ok'
+RETRY = 'retry'          # transient failure, retry later
+THROTTLED = 'throttled'  # server asked us to slow down, retry later
+FAIL = 'fail'            # permanent failure, do not retry
+
+class TokenBucket:
+  def __init__(self, rate, burst, clock=time.monotonic):
+    assert rate > 0 and burst >= 1
+    self.rate = rate
+    self.burst = burst
+    self.clock = clock
+    self.tokens = float(burst)
+    self.last = clock()
+
+  # Takes a token and returns 0, or returns the number of seconds to wait
+  # until a token is available.
+  def take(self):
+    now = self.clock()
+    self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+    self.last = now
+    if self.tokens >= 1:
+      self.tokens -= 1
+      return 0.0
+    return (1 - self.tokens) / self.rate
+
+class AdaptiveLimit:
+  """ Additive-increase/multiplicative-decrease concurrency limit.
+
+      record() takes whether the request went through without signs of
+      congestion, and its latency.
+  """
+  def __init__(self, initial, min_limit, max_limit, latency_target):
+    assert 1 <= min_limit <= max_limit
+    self.limit = max(min_limit, min(max_limit, initial))
+    self.min_limit = min_limit
+    self.max_limit = max_limit
+    self.latency_target = latency_target
+    self.successes = 0
+
+  def record(self, ok, latency):
+    if not ok:
+      self.limit = max(self.min_limit, self.limit // 2)
+      self.successes = 0
+    elif latency > self.latency_target:
+      self.limit = max(self.min_limit, self.limit - 1)
+      self.successes = 0
+    else:
+      self.successes += 1
+      if self.successes >= self.limit:
+        self.limit = min(self.max_limit, self.limit + 1)
+        self.successes = 0
+
+class HostState:
+  def __init__(self, bucket, limit):
+    self.bucket = bucket
+    self.limit = limit
+    self.in_flight = 0
+    self.requests = 0
+    self.retries = 0
+    self.throttles = 0
+
+class Scheduler:
+  def __init__(self, workers, per_host, rate, burst=None, max_retries=5,
+               backoff_base=1.0, backoff_cap=60.0, latency_target=5.0,
+               clock=time.monotonic, sleep=time.sleep):
+    assert workers > 0 and per_host > 0 and max_retries >= 0
+    self.workers = workers
+    self.per_host = per_host
+    self.rate = rate
+    self.burst = burst if burst is not None else max(1, per_host)
+    self.max_retries = max_retries
+    self.backoff_base = backoff_base
+    self.backoff_cap = backoff_cap
+    self.latency_target = latency_target
+    self.clock = clock
+    self.sleep = sleep
+    self.hosts = dict()
+
+  def host_state(self, host):
+    if host not in self.hosts:
+      max_limit = min(self.workers, self.per_host)
+      # Start at half of the allowed concurrency and let it grow.
+      self.hosts[host] = HostState(
+          TokenBucket(self.rate, self.burst, self.clock),
+          AdaptiveLimit(max(1, max_limit // 2), 1, max_limit,
+                        self.latency_target))
+    return self.hosts[host]
+
+  # Full jitter: uniform in [0, min(cap, base * 2^attempt)].
+  def backoff(self, attempt):
+    return random.uniform(
+        0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+  # Runs all jobs and returns a map from key to (state, value, attempts).
+  # on_done(key, state, value, attempts) is called in the scheduling thread
+  # when a job finishes for good.  If stop (a threading.Event) is set, jobs
+  # not yet started are dropped and run returns once the running ones finish.
+  def run(self, jobs, on_done=None, stop=None):
+    results = dict()
+    # Per-host retry queues ordered by (ready time, sequence number).
+    queues = dict()
+    seq = 0
+    now = self.clock()
+    for key, host, fn in jobs:
+      self.host_state(host)
+      queues.setdefault(host, [])
+      heapq.heappush(queues[host], (now, seq, key, fn, 0))
+      seq += 1
+    running = dict()  # future -> (key, host, fn, attempt, start)
+
+    with ThreadPoolExecutor(max_workers=self.workers) as executor:
+      while running or any(queues.values()):
+        if stop is not None and stop.is_set():
+          for queue in queues.values():
+            del queue[:]
+        # Dispatch ready jobs while their host has capacity and a token.
+        # The timeout is the earliest time a blocked host may proceed; hosts
+        # at their concurrency limit wait for a completion instead.
+        timeout = None
+        now = self.clock()
+        for host, queue in sorted(queues.items()):
+          hs = self.hosts[host]
+          while queue and len(running) < self.workers:
+            if hs.in_flight >= hs.limit.limit:
+              break
+            ready, s, key, fn, attempt = queue[0]
+            wait_time = max(0.0, ready - now)
+            if wait_time <= 0:
+              wait_time = hs.bucket.take()
+            if wait_time > 0:
+              if timeout is None or wait_time < timeout:
+                timeout = wait_time
+              break
+            heapq.heappop(queue)
+            hs.in_flight += 1
+            hs.requests += 1
+            running[executor.submit(fn)] = (key, host, fn, attempt,
+                                            self.clock())
+        if not running:
+          self.sleep(timeout or 0.0)
+          continue
+
+        done, _ = wait(list(running.keys()), timeout=timeout,
+                       return_when=FIRST_COMPLETED)
+        for future in done:
+          key, host, fn, attempt, start = running.pop(future)
+          hs = self.hosts[host]
+          hs.in_flight -= 1
+          try:
+            state, value = future.result()
+          except Exception as e:
+            state, value = RETRY, e
+          # A permanent failure (e.g. an unknown ticker) says nothing about
+          # congestion, so only retryable results lower the limit.
+          hs.limit.record(state not in (RETRY, THROTTLED),
+                          self.clock() - start)
+          if state == THROTTLED:
+            hs.throttles += 1
+          if state in (RETRY, THROTTLED) and attempt < self.max_retries:
+            hs.retries += 1
+            delay = self.backoff(attempt)
+            logging.debug('Retrying %s in %.2fs after %s (attempt %d)'
+                          % (key, delay, state, attempt + 1))
+            heapq.heappush(queues[host], (self.clock() + delay, seq, key,
+                                          fn, attempt + 1))
+            seq += 1
+            continue
+          results[key] = (state, value, attempt + 1)
+          if on_done is not None:
+            on_done(key, state, value, attempt + 1)
+
+    for host, hs in sorted(self.hosts.items()):
+      logging.info('%s: %d requests, %d retries, %d throttled,'
+                   ' final concurrency %d'
+                   % (host, hs.requests, hs.retries, hs.throttles,
+                      hs.limit.limit))
+    return results
@@ -0,0 +1,128 @@
+#!/usr/local/bin/python3
+
+""" Tests download_scheduler.py with a fake clock and fake job results.
+
+    Backoff jitter is fixed to its upper bound, and the clock only moves
+    when the scheduler sleeps, so every run is deterministic.
+
+    Run: python3 -m unittest download_scheduler_test
+"""
+
+import download_scheduler
+import unittest
+from download_scheduler import FAIL, OK, RETRY, THROTTLED
+from unittest import mock
+
+class FakeClock:
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.now += seconds
+
+# Returns a job function that returns states in order, the last one
+# repeatedly, and records the fake time of each call in calls.
+def job(clock, states, calls):
+  def fn():
+    calls.append(clock())
+    state = states[min(len(calls), len(states)) - 1]
+    return state, state
+  return fn
+
+def scheduler(clock, workers, max_retries=5):
+  return download_scheduler.Scheduler(
+      workers, workers, 1000.0, burst=100, max_retries=max_retries,
+      backoff_base=1.0, backoff_cap=60.0, clock=clock, sleep=clock.sleep)
+
+@mock.patch('download_scheduler.random.uniform', lambda low, high: high)
+class SchedulerTest(unittest.TestCase):
+  def test_states(self):
+    clock = FakeClock()
+    calls = {k: [] for k in 'ok retry throttled fail exhausted'.split()}
+    states = {
+        'ok': [OK],
+        'retry': [RETRY, OK],
+        'throttled': [THROTTLED, THROTTLED, OK],
+        'fail': [FAIL],
+        'exhausted': [RETRY],
+    }
+    jobs = [(k, 'host', job(clock, states[k], calls[k])) for k in states]
+    s = scheduler(clock, 1, max_retries=2)
+    done = []
+    results = s.run(jobs, lambda key, *rest: done.append(key))
+
+    self.assertEqual(results, {
+        'ok': (OK, OK, 1),
+        'retry': (OK, OK, 2),
+        'throttled': (OK, OK, 3),
+        'fail': (FAIL, FAIL, 1),
+        'exhausted': (RETRY, RETRY, 3),
+    })
+    self.assertEqual(sorted(done), sorted(states))
+    # FAIL is not retried; RETRY and THROTTLED wait 1s, then 2s.  The burst
+    # covers all requests, so retries are the only waits.
+    self.assertEqual(len(calls['fail']), 1)
+    for key in ('throttled', 'exhausted'):
+      self.assertEqual(calls[key][1] - calls[key][0], 1.0)
+      self.assertEqual(calls[key][2] - calls[key][1], 2.0)
+    self.assertEqual(calls['retry'][1] - calls['retry'][0], 1.0)
+    hs = s.hosts['host']
+    self.assertEqual(hs.requests, 10)
+    self.assertEqual(hs.retries, 5)
+    self.assertEqual(hs.throttles, 2)
+
+  def test_fail_does_not_lower_limit(self):
+    clock = FakeClock()
+    s = scheduler(clock, 8)
+    jobs = [(i, 'host', job(clock, [FAIL], [])) for i in range(4)]
+    s.run(jobs)
+    # Starts at half of 8.  Permanent failures say nothing about congestion,
+    # so they count as fast requests: 4 of them grow the limit by one.
+    self.assertEqual(s.hosts['host'].limit.limit, 5)
+
+  def test_throttled_halves_limit(self):
+    clock = FakeClock()
+    s = scheduler(clock, 8)
+    jobs = [(i, 'host', job(clock, [THROTTLED, OK], [])) for i in range(4)]
+    results = s.run(jobs)
+    self.assertEqual(set(results.values()), {(OK, OK, 2)})
+    # 4 throttles halve the limit down to 1, then the 4 successful retries
+    # grow it to 2 after one success and to 3 after two more.
+    self.assertEqual(s.hosts['host'].limit.limit, 3)
+
+  def test_stop(self):
+    clock = FakeClock()
+    s = scheduler(clock, 1)
+    calls = []
+    stop = mock.Mock()
+    stop.is_set.side_effect = lambda: len(calls) >= 2
+    jobs = [(i, 'host', job(clock, [OK], calls)) for i in range(5)]
+    results = s.run(jobs, stop=stop)
+    self.assertEqual(sorted(results), [0, 1])
+
+class AdaptiveLimitTest(unittest.TestCase):
+  def test_record(self):
+    limit = download_scheduler.AdaptiveLimit(2, 1, 4, 1.0)
+    # Grows by one after limit fast successes.
+    limit.record(True, 0.1)
+    self.assertEqual(limit.limit, 2)
+    limit.record(True, 0.1)
+    self.assertEqual(limit.limit, 3)
+    # Shrinks by one on a slow success.
+    limit.record(True, 2.0)
+    self.assertEqual(limit.limit, 2)
+    # Halves on a retryable failure, but not below min_limit.
+    limit.record(False, 0.1)
+    self.assertEqual(limit.limit, 1)
+    limit.record(False, 0.1)
+    self.assertEqual(limit.limit, 1)
+    # Never exceeds max_limit.
+    for _ in range(20):
+      limit.record(True, 0.1)
+    self.assertEqual(limit.limit, 4)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,337 @@
+#!/usr/local/bin/python3
+
+""" Computes Haugen factors and scores in process.
+
+    compute_factors() runs the stages of e2e_script.py for one date: current
+    prices, trading volumes, fundamentals, excess returns, the ratio
+    factors, scores and filtered scores.  Intermediate results are kept in
+    memory as {ticker: value} maps, so nothing is written unless asked for
+    and values are not rounded between stages.  The haugen_*.py scripts are
+    thin wrappers around the functions here.
+
+    Factor names:
+    - price, tv, mc
+    - os, revenue, ni, nic, pd, ta, tl, te, ia, ocf (see METRICS)
+    - er1, er2, er6, er12
+    - tv2mc, e2p, roe, b2p, cf2p
+    - score, filtered_score
+"""
+
+import haugen_current_price
+import haugen_excess_return
+import haugen_metric
+import haugen_trading_volume
+import logging
+import numpy as np
+import price_samples
+import utils
+
+# From table 1 of Haugen's paper.
+ER1 = ((-.97) + (-.72))/2
+ER12 = (.52 + .52) / 2
+TV2MC = ((-.35) + (-.2)) / 2
+ER2 = ((-.2) + (-.11)) / 2
+E2P = (.27 + .26) / 2
+ROE = (.24 + .13) / 2
+B2P = (.35 + .39) / 2
+ER6 = (.24 + .19) / 2
+CF2P = (.13 + .26) / 2
+
+# Factors of a score, and their weights in the order of SCORE_FACTORS.
+SCORE_FACTORS = ('er1', 'er12', 'tv2mc', 'er2', 'e2p', 'roe', 'b2p', 'er6',
+                 'cf2p')
+SCORE_WEIGHTS = (ER1, ER12, TV2MC, ER2, E2P, ROE, B2P, ER6, CF2P)
+
+# For filtering scores.
+MIN_PRICE = 5.0
+MIN_MC = 300.0 * 1000 * 1000
+
+# (name, statement type, metric, k, skip_empty).
+METRICS = (
+    ('os', 'is', 'outstanding_shares', 1, True),
+    ('revenue', 'is', 'revenue', 4, True),
+    ('ni', 'is', 'net_income', 4, True),
+    ('nic', 'is', 'net_income_common', 4, True),
+    ('pd', 'is', 'preferred_dividend', 4, False),
+    ('ta', 'bs', 'total_assets', 1, True),
+    ('tl', 'bs', 'total_liabilities', 1, True),
+    ('te', 'bs', 'total_equity', 1, True),
+    ('ia', 'bs', 'intangible_assets', 1, False),
+    ('ocf', 'cf', 'operating_cashflow', 4, True),
+)
+
+ER_HORIZONS = (1, 2, 6, 12)
+
+class Universe:
+  """ Ticker index shared by aligned factor columns.
+  """
+  def __init__(self, tickers):
+    self.tickers = sorted(set(tickers))
+    self.index = {t: i for i, t in enumerate(self.tickers)}
+
+  # Aligns a {ticker: value} map.  Tickers outside the universe are ignored.
+  # Returns: (values, present), values being NaN where not present.
+  def column(self, m):
+    values = np.full(len(self.tickers), np.nan)
+    present = np.zeros(len(self.tickers), dtype=bool)
+    for t, v in m.items():
+      i = self.index.get(t)
+      if i is not None:
+        values[i] = v
+        present[i] = True
+    return values, present
+
+  def to_map(self, values, valid):
+    return {self.tickers[i]: float(values[i]) for i in np.flatnonzero(valid)}
+
+# Inputs of the ratio factors.
+RATIO_INPUTS = {
+    'mc': ('price', 'os'),
+    'tv2mc': ('tv', 'price', 'os'),
+    'e2p': ('nic', 'price', 'os'),
+    'roe': ('ni', 'te'),
+    'b2p': ('ta', 'ia', 'tl', 'price', 'os'),
+    'cf2p': ('ocf', 'pd', 'price', 'os'),
+}
+
+# Computes every ratio factor whose inputs are in cols, {name: (values,
+# present)} arrays of any one shape, as array expressions.  Market cap is
+# computed once.  Intangible assets and preferred dividends are 0 where
+# missing; any other missing input makes the factor missing, as does a
+# division by zero.
+# Returns: {factor name: (values, valid)}.
+def ratio_arrays(cols):
+  def ok(*names):
+    valid = cols[names[0]][1].copy()
+    for name in names[1:]:
+      valid &= cols[name][1]
+    return valid
+  def default_zero(name):
+    values, present = cols[name]
+    return np.where(present, values, 0.0)
+  def has(name):
+    return all(n in cols for n in RATIO_INPUTS[name])
+
+  outputs = dict()
+  with np.errstate(divide='ignore', invalid='ignore'):
+    if has('roe'):
+      outputs['roe'] = (cols['ni'][0] / cols['te'][0], ok('ni', 'te'))
+    # The other ratios are of price and shares, see RATIO_INPUTS.
+    if has('mc'):
+      p, s = cols['price'][0], cols['os'][0]
+      mc_values = p * s
+      outputs['mc'] = (mc_values, ok('price', 'os'))
+      if has('tv2mc'):
+        outputs['tv2mc'] = (cols['tv'][0] / mc_values,
+                            ok('tv', 'price', 'os'))
+      if has('e2p'):
+        outputs['e2p'] = (cols['nic'][0] / s / p, ok('nic', 'price', 'os'))
+      if has('b2p'):
+        book = cols['ta'][0] - default_zero('ia') - cols['tl'][0]
+        outputs['b2p'] = (book / s / p, ok('ta', 'tl', 'price', 'os'))
+      if has('cf2p'):
+        cf = cols['ocf'][0] - default_zero('pd')
+        outputs['cf2p'] = (cf / s / p, ok('ocf', 'price', 'os'))
+
+  for name, (values, valid) in outputs.items():
+    finite = np.isfinite(values)
+    dropped = np.count_nonzero(valid & ~finite)
+    if dropped > 0:
+      logging.warning('Dropped %d non-finite values of %s' % (dropped, name))
+    outputs[name] = (values, valid & finite)
+  return outputs
+
+# ratio_arrays() of {name: map} inputs aligned over the universe.
+def ratio_factors(universe, maps):
+  return ratio_arrays({name: universe.column(m) for name, m in maps.items()})
+
+# Computes ratio factors of {name: map} inputs.
+# Returns: {factor name: {ticker: value}}.
+def ratio_maps(maps):
+  universe = Universe(t for m in maps.values() for t in m)
+  outputs = ratio_factors(universe, maps)
+  return {name: universe.to_map(values, valid)
+          for name, (values, valid) in outputs.items()}
+
+def tv2mc(tv_map, p_map, s_map):
+  return ratio_maps({'tv': tv_map, 'price': p_map, 'os': s_map})['tv2mc']
+
+def e2p(ni_map, p_map, s_map):
+  return ratio_maps({'nic': ni_map, 'price': p_map, 'os': s_map})['e2p']
+
+def roe(ni_map, e_map):
+  return ratio_maps({'ni': ni_map, 'te': e_map})['roe']
+
+def b2p(ta_map, ia_map, tl_map, p_map, s_map):
+  return ratio_maps({'ta': ta_map, 'ia': ia_map, 'tl': tl_map,
+                     'price': p_map, 'os': s_map})['b2p']
+
+def cf2p(cf_map, pd_map, p_map, s_map):
+  return ratio_maps({'ocf': cf_map, 'pd': pd_map, 'price': p_map,
+                     'os': s_map})['cf2p']
+
+def mc(p_map, s_map):
+  return ratio_maps({'price': p_map, 'os': s_map})['mc']
+
+def score(er1_map, er12_map, tv2mc_map, er2_map, e2p_map, roe_map, b2p_map,
+          er6_map, cf2p_map):
+  tickers = (er1_map.keys() & er12_map.keys() & tv2mc_map.keys()
+             & er2_map.keys() & e2p_map.keys() & roe_map.keys()
+             & b2p_map.keys() & er6_map.keys() & cf2p_map.keys())
+  logging.info('%d tickers' % len(tickers))
+  logging.info('total weight: %f' %
+      (ER1 + ER12 + TV2MC + ER2 + E2P + ROE + B2P + ER6 + CF2P))
+  s_map = dict()
+  for t in tickers:
+    s_map[t] = (er1_map[t] * ER1
+                + er12_map[t] * ER12
+                + tv2mc_map[t] * TV2MC
+                + er2_map[t] * ER2
+                + e2p_map[t] * E2P
+                + roe_map[t] * ROE
+                + b2p_map[t] * B2P
+                + er6_map[t] * ER6
+                + cf2p_map[t] * CF2P) / 100  # accounting for %
+  return s_map
+
+# Reads weight sets for score_matrix().  The first line lists the factor
+# names, the others are "<name> <weight>..." lines with one weight per
+# factor.  All factors of SCORE_FACTORS must be listed.
+# Returns: (names, weights), weights being sets x SCORE_FACTORS.
+def read_weights(weights_path):
+  with open(weights_path, 'r') as fp:
+    lines = [line for line in fp.read().splitlines() if line.strip() != '']
+  assert len(lines) > 1, 'no weight sets in %s' % weights_path
+  header = lines[0].split()
+  assert sorted(header) == sorted(SCORE_FACTORS), (
+      'header must list %s: %s' % (' '.join(SCORE_FACTORS), lines[0]))
+  columns = [header.index(f) for f in SCORE_FACTORS]
+  names, weights = [], []
+  for line in lines[1:]:
+    items = line.split()
+    assert len(items) == len(header) + 1, 'bad weight line: %s' % line
+    names.append(items[0])
+    weights.append([float(items[1 + j]) for j in columns])
+  assert len(set(names)) == len(names), (
+      'duplicate weight set names in %s' % weights_path)
+  return names, np.array(weights)
+
+# Scores the universe with every weight set (sets x SCORE_FACTORS) in one
+# matrix multiply.  A ticker is scored if it has all SCORE_FACTORS.
+# Returns: (scores, valid), scores being sets x tickers.
+def score_matrix(universe, maps, weights):
+  weights = np.asarray(weights, dtype=float)
+  assert weights.ndim == 2 and weights.shape[1] == len(SCORE_FACTORS)
+  factors = np.zeros((len(universe.tickers), len(SCORE_FACTORS)))
+  valid = np.ones(len(universe.tickers), dtype=bool)
+  for j in range(len(SCORE_FACTORS)):
+    values, present = universe.column(maps[SCORE_FACTORS[j]])
+    factors[:, j] = np.where(present, values, 0.0)
+    valid &= present
+  scores = weights @ factors.T / 100  # accounting for %
+  return scores, valid
+
+def filter_scores(s_map, p_map, mc_map):
+  tickers = s_map.keys() & p_map.keys() & mc_map.keys()
+  return {t: s_map[t] for t in tickers
+          if p_map[t] >= MIN_PRICE and mc_map[t] >= MIN_MC}
+
+class Factors:
+  """ Factor maps of a universe, with aligned array views.
+  """
+  def __init__(self, tickers, maps):
+    self.universe = Universe(tickers)
+    self.tickers = self.universe.tickers
+    self.maps = maps
+
+  # Returns the values of a factor aligned with self.tickers, NaN where
+  # missing.
+  def values(self, name):
+    return self.universe.column(self.maps[name])[0]
+
+  # Writes a factor as "<ticker> <value>" lines, prices with the format of
+  # haugen_current_price.py.
+  def write(self, name, output_path):
+    if name == 'price':
+      utils.write_map(self.maps[name], output_path,
+                      haugen_current_price.PRICE_FORMAT)
+    else:
+      utils.write_map(self.maps[name], output_path)
+
+# Stages of compute_factors().  Each returns {factor name: {ticker: value}}
+# and only depends on its arguments, so stages can run in any order or in
+# separate processes.
+
+def current_prices(tickers, price_sample_dir, yyyy_mm):
+  return {'price': prices_at(tickers, price_sample_dir, [yyyy_mm])[0]}
+
+# Returns one {ticker: price} map per date.
+def prices_at(tickers, price_sample_dir, dates):
+  matrix = price_samples.load(price_sample_dir, tickers)
+  return haugen_current_price.price_maps(matrix, dates)
+
+# Trading volumes averaged over k months come from cube_dir, store_dir or
+# price_dir, whichever is set first.
+def trading_volumes(tickers, yyyy_mm, price_dir='', cube_dir='',
+                    store_dir='', k=1):
+  if cube_dir != '':
+    tv_map = haugen_trading_volume.read_cube(cube_dir, tickers, yyyy_mm, k)
+  elif store_dir != '':
+    tv_map = haugen_trading_volume.read_store(store_dir, tickers, yyyy_mm, k)
+  else:
+    assert price_dir != '', (
+        'one of price_dir, cube_dir and store_dir is needed')
+    tv_map = haugen_trading_volume.read_prices(price_dir, tickers, yyyy_mm, k)
+  return {'tv': tv_map}
+
+# Extracts METRICS of one statement type in a single scan of input_dir.
+def fundamentals(tickers, report_type, input_dir, yyyy_mm):
+  metrics = [m for m in METRICS if m[1] == report_type]
+  results = haugen_metric.extract(tickers, input_dir, [yyyy_mm],
+                                  [m[2:] for m in metrics])
+  return {metrics[s][0]: results[(s, yyyy_mm)] for s in range(len(metrics))}
+
+def excess_returns(tickers, price_sample_dir, market_sample_path, yyyy_mm):
+  matrix = price_samples.load(price_sample_dir, tickers, keep_last=True)
+  market = price_samples.load_paths(['^GSPC'], [market_sample_path],
+                                    keep_last=True)
+  results = haugen_excess_return.excess_return_maps(
+      matrix, market, [yyyy_mm], ER_HORIZONS)
+  return {'er%d' % k: results[(k, yyyy_mm)] for k in ER_HORIZONS}
+
+# Derives the ratio factors, scores and filtered scores from the maps of
+# the other stages.
+def combine(maps):
+  maps = dict(maps)
+  maps.update(ratio_maps({n: maps[n] for n in
+                          set(sum(RATIO_INPUTS.values(), ()))}))
+  maps['score'] = score(maps['er1'], maps['er12'], maps['tv2mc'],
+                        maps['er2'], maps['e2p'], maps['roe'], maps['b2p'],
+                        maps['er6'], maps['cf2p'])
+  maps['filtered_score'] = filter_scores(maps['score'], maps['price'],
+                                         maps['mc'])
+  return maps
+
+# Stage form of combine(), taking the results of the other stages as keyword
+# arguments.
+def combine_stages(**results):
+  maps = dict()
+  for name in sorted(results):
+    maps.update(results[name])
+  return combine(maps)
+
+# Computes all factors of tickers at yyyy_mm.  See trading_volumes() for
+# where trading volumes come from.
+def compute_factors(yyyy_mm, tickers, price_sample_dir, market_sample_path,
+                    is_dir, bs_dir, cf_dir, price_dir='', cube_dir='',
+                    store_dir='', tv_k=1):
+  maps = dict()
+  maps.update(current_prices(tickers, price_sample_dir, yyyy_mm))
+  maps.update(trading_volumes(tickers, yyyy_mm, price_dir, cube_dir,
+                              store_dir, tv_k))
+  for report_type, input_dir in (('is', is_dir), ('bs', bs_dir),
+                                 ('cf', cf_dir)):
+    maps.update(fundamentals(tickers, report_type, input_dir, yyyy_mm))
+  maps.update(excess_returns(tickers, price_sample_dir, market_sample_path,
+                             yyyy_mm))
+  return Factors(tickers, combine(maps))
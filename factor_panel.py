@@ -0,0 +1,108 @@
+#!/usr/local/bin/python3
+
+""" Builds ticker x month panels of Haugen factors.
+
+    The whole-array counterpart of factor_engine.compute_factors(): every
+    factor is computed for every ticker and month in one pass, from price
+    samples (price_samples.py), a volume cube (volume_cube.py) and a
+    fundamentals store (fundamentals_store.py), with the same rules as the
+    per-month scripts.
+"""
+
+import factor_engine
+import fundamentals_store
+import logging
+import numpy as np
+import price_samples
+import trailing_metric
+import volume_cube
+
+# Aligns the rows of a (values, valid) pair indexed by row_index
+# ({ticker: row}) to tickers.  Tickers without a row are invalid.
+def align(tickers, row_index, values, valid):
+  rows = np.array([row_index.get(t, -1) for t in tickers], dtype=np.int64)
+  has_row = rows >= 0
+  values = np.where(has_row[:, None], np.asarray(values)[np.maximum(rows, 0)],
+                    np.nan)
+  valid = has_row[:, None] & np.asarray(valid)[np.maximum(rows, 0)]
+  return values, valid
+
+class Panel:
+  """ tickers: sorted tickers, months: month ordinals, factors: {name:
+      (values, valid)}, both tickers x months.
+  """
+  def __init__(self, tickers, months, factors):
+    self.tickers = tickers
+    self.ticker_index = {t: i for i, t in enumerate(tickers)}
+    self.months = months
+    self.factors = factors
+
+  # Returns tickers x months x len(names) values and the tickers x months
+  # mask where all of them are valid.
+  def stack(self, names):
+    values = np.stack([self.factors[n][0] for n in names], axis=2)
+    valid = np.ones((len(self.tickers), len(self.months)), dtype=bool)
+    for n in names:
+      valid &= self.factors[n][1]
+    return values, valid
+
+# Loads the inputs of a panel once, so that panels of different months can
+# be built from the same arrays.
+class Inputs:
+  def __init__(self, tickers, price_sample_dir, market_sample_path,
+               store_dir, cube_dir):
+    self.tickers = sorted(set(tickers))
+    # Prices use the first sample of a month, as haugen_current_price.py
+    # does, and excess returns the last, as haugen_excess_return.py does.
+    self.matrix = price_samples.load(price_sample_dir, self.tickers)
+    self.return_matrix = price_samples.load(price_sample_dir, self.tickers,
+                                            keep_last=True)
+    self.market = price_samples.load_paths(['^GSPC'], [market_sample_path],
+                                           keep_last=True)
+    self.store = fundamentals_store.Store(store_dir)
+    self.cube = volume_cube.Cube(cube_dir)
+
+# Builds the panel of all factors of factor_engine for the given month
+# ordinals.  tv_k is the number of months trading volumes are averaged over.
+def build(inputs, months, tv_k=1):
+  months = np.asarray(months, dtype=np.int64)
+  tickers = inputs.tickers
+  n = len(tickers)
+  cols = dict()
+
+  # Rows are in tickers order.  Prices are rounded to 2 decimals, as
+  # haugen_current_price.price_maps() does.
+  prices = np.round(inputs.matrix.lookup(months), 2)
+  cols['price'] = (prices, ~np.isnan(prices))
+
+  volumes, valid = inputs.cube.trailing_volume(months, tv_k)
+  cols['tv'] = align(tickers, inputs.cube.ticker_index, volumes, valid)
+
+  store = inputs.store
+  for name, _, metric, k, skip_empty in factor_engine.METRICS:
+    if metric not in store.metric_sources:
+      logging.warning('Metric is missing from store: %s' % metric)
+      cols[name] = (np.full((n, len(months)), np.nan),
+                    np.zeros((n, len(months)), dtype=bool))
+      continue
+    sums, valid = trailing_metric.trailing_sums(
+        store.values(metric), store.present(metric), store.reported(metric),
+        store.quarters, months, k, skip_empty)
+    cols[name] = align(tickers, store.ticker_index, sums, valid)
+
+  results = price_samples.excess_returns(inputs.return_matrix, inputs.market,
+                                         months, factor_engine.ER_HORIZONS)
+  for k in factor_engine.ER_HORIZONS:
+    cols['er%d' % k] = results[k]
+
+  cols.update(factor_engine.ratio_arrays(cols))
+  logging.info('Built a panel of %d tickers x %d months' % (n, len(months)))
+  return Panel(tickers, months, cols)
+
+# Excess returns over the month after each month: the returns that factors
+# of a month predict.
+# Returns: (returns, valid), both tickers x months.
+def forward_returns(inputs, months):
+  months = np.asarray(months, dtype=np.int64)
+  return price_samples.excess_returns(inputs.return_matrix, inputs.market,
+                                      months + 1, [1])[1]
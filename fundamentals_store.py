@@ -0,0 +1,158 @@
+#!/usr/local/bin/python3
+
+""" Builds and loads a columnar store of parsed financial reports.
+
+    The parse_* scripts write one small csv file per ticker.  This script
+    consolidates them into dense ticker x quarter-end arrays, one per metric,
+    saved as NumPy files that are loaded memory-mapped, so that a consumer
+    only reads the metrics it needs and does no parsing.
+
+    Store layout:
+    - tickers.txt: the ticker index, one ticker per line.
+    - quarters.npy: the quarter-end index, as sorted month ordinals (see
+      utils.month_ordinal) of all report dates of all tickers.
+    - metrics.txt: one "<metric> <source>" line per metric, where the source
+      names the report type (eg, is) the metric was parsed from.
+    - dates_<source>.npy: bool tickers x quarters, True where the ticker has
+      a report of that source for that quarter.
+    - metric_<metric>.npy: float64 tickers x quarters, NaN where the value is
+      empty or the quarter is not reported.
+    - present_<metric>.npy: bool tickers, True if the ticker's report has the
+      metric at all.
+
+    Usage: --source is:../data/is_3_p --source bs:../data/bs_3_p ...
+"""
+
+import argparse
+import logging
+import numpy as np
+import utils
+from os import makedirs, path
+
+def read_parsed(input_path):
+  with open(input_path, 'r') as fp:
+    lines = fp.read().splitlines()
+  assert len(lines) > 0
+  items = lines[0].split(',')
+  assert items[0] == 'date'
+  dates = items[1:]
+  rows = dict()
+  for line in lines[1:]:
+    items = line.split(',')
+    assert len(items) == len(dates) + 1
+    rows[items[0]] = items[1:]
+  return dates, rows
+
+def build(tickers, sources, output_dir):
+  # First pass: read everything and collect the quarter index.
+  data = dict()  # (source, ticker index) -> (dates, rows)
+  metric_sources = dict()
+  quarters = set()
+  for name, input_dir in sources:
+    for i in range(len(tickers)):
+      input_path = '%s/%s.csv' % (input_dir, tickers[i].replace('^', '_'))
+      if not path.isfile(input_path):
+        logging.debug('Input file is missing: %s' % input_path)
+        continue
+      dates, rows = read_parsed(input_path)
+      assert len(set(dates)) == len(dates), input_path
+      data[(name, i)] = (dates, rows)
+      quarters.update(utils.month_ordinal(d) for d in dates)
+      for metric in rows:
+        assert metric_sources.get(metric, name) == name, (
+            'metric %s found in more than one source' % metric)
+        metric_sources[metric] = name
+    logging.info('Read %d %s reports'
+                 % (sum(1 for s, _ in data if s == name), name))
+  quarters = np.array(sorted(quarters), dtype=np.int32)
+  quarter_index = {q: j for j, q in enumerate(quarters.tolist())}
+  logging.info('%d tickers, %d quarters, %d metrics'
+               % (len(tickers), len(quarters), len(metric_sources)))
+
+  # Second pass: fill in the arrays.
+  shape = (len(tickers), len(quarters))
+  reported = {name: np.zeros(shape, dtype=bool) for name, _ in sources}
+  values = {m: np.full(shape, np.nan) for m in metric_sources}
+  present = {m: np.zeros(len(tickers), dtype=bool) for m in metric_sources}
+  for (name, i), (dates, rows) in data.items():
+    columns = [quarter_index[utils.month_ordinal(d)] for d in dates]
+    reported[name][i, columns] = True
+    for metric, items in rows.items():
+      present[metric][i] = True
+      for j, item in zip(columns, items):
+        if item != '':
+          values[metric][i, j] = float(item)
+
+  makedirs(output_dir, exist_ok=True)
+  with open('%s/tickers.txt' % output_dir, 'w') as fp:
+    for ticker in tickers:
+      print(ticker, file=fp)
+  np.save('%s/quarters.npy' % output_dir, quarters)
+  with open('%s/metrics.txt' % output_dir, 'w') as fp:
+    for metric in sorted(metric_sources.keys()):
+      print('%s %s' % (metric, metric_sources[metric]), file=fp)
+  for name, array in reported.items():
+    np.save('%s/dates_%s.npy' % (output_dir, name), array)
+  for metric in metric_sources:
+    np.save('%s/metric_%s.npy' % (output_dir, metric), values[metric])
+    np.save('%s/present_%s.npy' % (output_dir, metric), present[metric])
+
+class Store:
+  """ Read-only view of a store.  Arrays are memory-mapped on first use.
+  """
+  def __init__(self, store_dir):
+    self.store_dir = store_dir
+    with open('%s/tickers.txt' % store_dir, 'r') as fp:
+      self.tickers = fp.read().splitlines()
+    self.ticker_index = {t: i for i, t in enumerate(self.tickers)}
+    self.quarters = np.load('%s/quarters.npy' % store_dir)
+    self.metric_sources = dict()
+    with open('%s/metrics.txt' % store_dir, 'r') as fp:
+      for line in fp.read().splitlines():
+        metric, source = line.split(' ')
+        self.metric_sources[metric] = source
+    self.arrays = dict()
+
+  def load(self, name):
+    if name not in self.arrays:
+      self.arrays[name] = np.load('%s/%s.npy' % (self.store_dir, name),
+                                  mmap_mode='r')
+    return self.arrays[name]
+
+  # tickers x quarters, NaN for empty cells.
+  def values(self, metric):
+    return self.load('metric_%s' % metric)
+
+  # tickers, whether the ticker reports the metric.
+  def present(self, metric):
+    return self.load('present_%s' % metric)
+
+  # tickers x quarters, whether the ticker reported the metric's source for
+  # the quarter.
+  def reported(self, metric):
+    return self.load('dates_%s' % self.metric_sources[metric])
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--ticker_file', required=True)
+  # <source>:<dir> of parsed reports, eg is:../data/is_3_p.  Repeatable.
+  parser.add_argument('--source', action='append', required=True)
+  parser.add_argument('--output_dir', required=True)
+  parser.add_argument('--verbose', action='store_true')
+  args = parser.parse_args()
+
+  utils.setup_logging(args.verbose)
+
+  # Tickers are listed one per line.
+  with open(args.ticker_file, 'r') as fp:
+    tickers = fp.read().splitlines()
+  logging.info('Processing %d tickers' % len(tickers))
+
+  sources = []
+  for source in args.source:
+    name, input_dir = source.split(':', 1)
+    sources.append((name, input_dir))
+  build(tickers, sources, args.output_dir)
+
+if __name__ == '__main__':
+  main()
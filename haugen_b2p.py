@@ -1,6 +1,7 @@
 #!/usr/local/bin/python3
 
 import argparse
+import factor_engine
 import logging
 import utils
 from os import path
@@ -19,24 +20,12 @@ def main():
   utils.setup_logging(args.verbose)
 
   ta_map = utils.read_map(args.total_assets_path)
+  ia_map = utils.read_map(args.intangible_assets_path)
   tl_map = utils.read_map(args.total_liabilities_path)
   p_map = utils.read_map(args.prices_path)
   s_map = utils.read_map(args.outstanding_shares_path)
-  tickers = ta_map.keys() & tl_map.keys() & p_map.keys() & s_map.keys()
-
-  # intangible assets are 0 by default
-  ia_map = dict()
-  for t in tickers:
-    ia_map[t] = 0.0
-  ia_part = utils.read_map(args.intangible_assets_path)
-  for k, v in ia_part.items():
-    ia_map[k] = v
-
-  with open(args.output_path, 'w') as fp:
-    for ticker in sorted(tickers):
-      output = ((ta_map[ticker] - ia_map[ticker] - tl_map[ticker])
-                / s_map[ticker] / p_map[ticker])
-      print('%s %f' % (ticker, output), file=fp)
+  utils.write_map(factor_engine.b2p(ta_map, ia_map, tl_map, p_map, s_map),
+                  args.output_path)
 
 if __name__ == '__main__':
   main()
@@ -1,6 +1,7 @@
 #!/usr/local/bin/python3
 
 import argparse
+import factor_engine
 import logging
 import utils
 from os import path
@@ -18,23 +19,11 @@ def main():
   utils.setup_logging(args.verbose)
 
   cf_map = utils.read_map(args.operating_cashflow_path)
+  pd_map = utils.read_map(args.preferred_dividend_path)
   p_map = utils.read_map(args.prices_path)
   s_map = utils.read_map(args.outstanding_shares_path)
-  tickers = cf_map.keys() & p_map.keys() & s_map.keys()
-
-  # preferred dividend is default to 0
-  pd_map = dict()
-  for t in tickers:
-    pd_map[t] = 0.0
-  pd_part = utils.read_map(args.preferred_dividend_path)
-  for k, v in pd_part.items():
-    pd_map[k] = v
-
-  with open(args.output_path, 'w') as fp:
-    for ticker in sorted(tickers):
-      output = ((cf_map[ticker] - pd_map[ticker])
-                / s_map[ticker] / p_map[ticker])
-      print('%s %f' % (ticker, output), file=fp)
+  utils.write_map(factor_engine.cf2p(cf_map, pd_map, p_map, s_map),
+                  args.output_path)
 
 if __name__ == '__main__':
   main()
@@ -5,48 +5,52 @@
 
 import argparse
 import logging
+import numpy as np
+import price_samples
 import utils
-from os import path
+
+# Prices are written, and so read by the other scripts, with 2 decimals.
+PRICE_FORMAT = '%.2f'
+
+# Returns one {ticker: price} map per date.  Prices are rounded to 2
+# decimals, as written to the price files.
+def price_maps(matrix, dates):
+  prices = matrix.lookup([utils.month_ordinal(d) for d in dates])
+  has_data = ~np.isnan(matrix.prices).all(axis=1)
+  maps = [dict() for _ in dates]
+  for ticker, i in sorted(matrix.ticker_index.items()):
+    for j in range(len(dates)):
+      if not np.isnan(prices[i, j]):
+        maps[j][ticker] = round(float(prices[i, j]), 2)
+      elif has_data[i]:
+        logging.warning('Could not find current price data for %s' % ticker)
+  return maps
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--ticker_file', required=True)
   parser.add_argument('--price_sample_dir', required=True)
+  # One or more dates, separated by commas.  With more than one date,
+  # --output_path must contain "{yyyy_mm}", which is replaced by the date.
   parser.add_argument('--yyyy_mm', required=True)
   parser.add_argument('--output_path', required=True)
   parser.add_argument('--verbose', action='store_true')
   args = parser.parse_args()
 
   utils.setup_logging(args.verbose)
+  dates = args.yyyy_mm.split(',')
+  assert len(dates) == 1 or args.output_path.find('{yyyy_mm}') >= 0
 
   # Tickers are listed one per line.
   with open(args.ticker_file, 'r') as fp:
     tickers = fp.read().splitlines()
   logging.info('Processing %d tickers' % len(tickers))
 
-  price_map = dict()
-  for i in range(len(tickers)):
-    ticker = tickers[i]
-    logging.info('%d/%d: %s' % (i+1, len(tickers), ticker))
-    input_path = '%s/%s.csv' % (args.price_sample_dir, ticker.replace('^', '_'))
-    if not path.isfile(input_path):
-      logging.warning('Input file is missing: %s' % input_path)
-      continue
-    with open(input_path, 'r') as fp:
-      lines = fp.read().splitlines()
-    found = False
-    for line in lines:
-      if line.startswith(args.yyyy_mm):
-        d, v, p = line.split(' ')
-        price_map[ticker] = float(p)
-        found = True
-        break
-    if not found:
-      logging.warning('Could not find current price data for %s' % ticker)
-  with open(args.output_path, 'w') as fp:
-    for ticker in sorted(price_map.keys()):
-      print('%s %.2f' % (ticker, price_map[ticker]), file=fp)
+  matrix = price_samples.load(args.price_sample_dir, tickers)
+  maps = price_maps(matrix, dates)
+  for j in range(len(dates)):
+    output_path = args.output_path.replace('{yyyy_mm}', dates[j])
+    utils.write_map(maps[j], output_path, PRICE_FORMAT)
 
 if __name__ == '__main__':
   main()
-
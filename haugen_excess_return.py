@@ -2,56 +2,43 @@
 
 import argparse
 import logging
+import numpy as np
+import price_samples
 import utils
-from os import path
 
-PRICE_BONUS = 0.01
-MIN_CAP = -1.0
-MAX_CAP = 1.0
+PRICE_BONUS = price_samples.PRICE_BONUS
+MIN_CAP = price_samples.MIN_CAP
+MAX_CAP = price_samples.MAX_CAP
 
-def read_samples(file_path):
-  with open(file_path, 'r') as fp:
-    lines = fp.read().splitlines()
-  d = dict()
-  for line in lines:
-    dt, vo, pr = line.split(' ')
-    pr = float(pr)
-    d[dt[:7]] = pr
-  return d
-
-# Computes the yyyy-mm string that is delta months before the current yyyy-mm
-# string.
-def compute_date(current_date, delta):
-  y, m = current_date.split('-')
-  y, m = int(y), int(m)
-  yd = int(delta / 12)
-  md = delta % 12
-  y -= yd
-  m -= md
-  if m < 1:
-    y -= 1
-    m += 12
-  return '%04d-%02d' % (y, m)
-
-def compute_excess(stock_from, stock_to, market_from, market_to,
-                   bonus=PRICE_BONUS, min_cap=MIN_CAP, max_cap=MAX_CAP):
-  assert stock_from >= 0
-  assert stock_to >= 0
-  assert market_from >= 0
-  assert market_to >= 0
-  assert bonus > 0  # bonus must be positive to prevent divide-by-zero errors.
-  stock_r = (stock_to - stock_from) / (stock_from + bonus)
-  market_r = (market_to - market_from) / (market_from + bonus)
-  excess = stock_r - market_r
-  if excess > max_cap: return max_cap
-  if excess < min_cap: return min_cap
-  return excess
+# Returns {(k, date): {ticker: excess return}} for every horizon and date.
+# matrix and market are loaded with keep_last, so the last sample of a month
+# is used.
+def excess_return_maps(matrix, market, dates, ks):
+  months = [utils.month_ordinal(d) for d in dates]
+  results = price_samples.excess_returns(matrix, market, months, ks)
+  has_data = ~np.isnan(matrix.prices).all(axis=1)
+  maps = dict()
+  for k in ks:
+    excess, valid = results[k]
+    for j in range(len(dates)):
+      m = dict()
+      for ticker, i in sorted(matrix.ticker_index.items()):
+        if valid[i, j]:
+          m[ticker] = float(excess[i, j])
+        elif has_data[i]:
+          logging.warning('Insufficient data for %s (%s, k=%d)'
+                          % (ticker, dates[j], k))
+      maps[(k, dates[j])] = m
+  return maps
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--ticker_file', required=True)
   parser.add_argument('--price_sample_dir', required=True)
   parser.add_argument('--market_sample_path', required=True)
+  # One or more dates and horizons, separated by commas.  With more than one
+  # of either, --output_path must contain "{yyyy_mm}" and/or "{k}", which
+  # are replaced by the date and the horizon.
   parser.add_argument('--yyyy_mm', required=True)
   parser.add_argument('--k', required=True)
   parser.add_argument('--output_path', required=True)
@@ -59,45 +46,33 @@ def main():
   args = parser.parse_args()
 
   utils.setup_logging(args.verbose)
-  k = int(args.k)
-  assert k > 0
+  dates = args.yyyy_mm.split(',')
+  ks = [int(k) for k in args.k.split(',')]
+  for k in ks:
+    assert k > 0
+  assert len(dates) == 1 or args.output_path.find('{yyyy_mm}') >= 0
+  assert len(ks) == 1 or args.output_path.find('{k}') >= 0
 
-  market_samples = read_samples(args.market_sample_path)
-  curr_date = args.yyyy_mm
-  prev_date = compute_date(curr_date, k)
-  logging.info('current date = %s, previous date = %s' % (curr_date, prev_date))
-  assert curr_date in market_samples
-  assert prev_date in market_samples
+  market = price_samples.load_paths(['^GSPC'], [args.market_sample_path],
+                                    keep_last=True)
 
   # Tickers are listed one per line.
   with open(args.ticker_file, 'r') as fp:
     tickers = fp.read().splitlines()
   logging.info('Processing %d tickers' % len(tickers))
-
-  excess_map = dict()
-  for i in range(len(tickers)):
-    ticker = tickers[i]
+  for ticker in tickers:
     assert ticker.find('^') == -1  # ^GSPC should not be in tickers.
-    logging.info('%d/%d: %s' % (i+1, len(tickers), ticker))
-    stock_sample_path = '%s/%s.csv' % (args.price_sample_dir, ticker)
-    if not path.isfile(stock_sample_path):
-      logging.warning('Input file does not exist: %s' % stock_sample_path)
-      continue
-    stock_samples = read_samples(stock_sample_path)
-    if (curr_date not in stock_samples
-        or prev_date not in stock_samples):
-      logging.warning('Insufficient data for %s' % ticker)
-      continue
-    excess = compute_excess(
-        stock_samples[prev_date], stock_samples[curr_date],
-        market_samples[prev_date], market_samples[curr_date])
-    excess_map[ticker] = excess
-  with open(args.output_path, 'w') as fp:
-    for ticker in sorted(excess_map.keys()):
-      print('%s %f' % (ticker, excess_map[ticker]), file=fp)
+
+  # All dates and horizons are computed from one load of the samples.
+  matrix = price_samples.load(args.price_sample_dir, tickers, keep_last=True)
+  maps = excess_return_maps(matrix, market, dates, ks)
+  for k in ks:
+    for date in dates:
+      output_path = args.output_path.replace('{yyyy_mm}', date).replace(
+          '{k}', str(k))
+      with open(output_path, 'w') as fp:
+        for ticker in sorted(maps[(k, date)].keys()):
+          print('%s %f' % (ticker, maps[(k, date)][ticker]), file=fp)
 
 if __name__ == '__main__':
   main()
-
-
-
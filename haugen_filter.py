@@ -1,13 +1,11 @@
 #!/usr/local/bin/python3
 
 import argparse
+import factor_engine
 import logging
 import utils
 from os import path
 
-MIN_PRICE = 5.0
-MIN_MC = 300.0 * 1000 * 1000
-
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--scores_path', required=True)
@@ -22,13 +20,8 @@ def main():
   s_map = utils.read_map(args.scores_path)
   p_map = utils.read_map(args.prices_path)
   mc_map = utils.read_map(args.mc_path)
-  tickers = s_map.keys() & p_map.keys() & mc_map.keys()
-
-  with open(args.output_path, 'w') as fp:
-    for ticker in sorted(tickers):
-      if p_map[ticker] < MIN_PRICE: continue
-      if mc_map[ticker] < MIN_MC: continue
-      print('%s %f' % (ticker, s_map[ticker]), file=fp)
+  utils.write_map(factor_engine.filter_scores(s_map, p_map, mc_map),
+                  args.output_path)
 
 if __name__ == '__main__':
   main()
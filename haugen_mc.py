@@ -1,6 +1,7 @@
 #!/usr/local/bin/python3
 
 import argparse
+import factor_engine
 import logging
 import utils
 from os import path
@@ -17,12 +18,7 @@ def main():
 
   p_map = utils.read_map(args.prices_path)
   s_map = utils.read_map(args.outstanding_shares_path)
-  tickers = p_map.keys() & s_map.keys()
-
-  with open(args.output_path, 'w') as fp:
-    for ticker in sorted(tickers):
-      output = p_map[ticker] * s_map[ticker]
-      print('%s %f' % (ticker, output), file=fp)
+  utils.write_map(factor_engine.mc(p_map, s_map), args.output_path)
 
 if __name__ == '__main__':
   main()
@@ -1,103 +1,314 @@
 #!/usr/local/bin/python3
 
 """ Measures error of predicted returns.
+
+    Scores are measured against the returns to each --future_prices_path,
+    which can be repeated, one per horizon.  Tickers are ranked by score
+    once, and all horizons are measured as arrays of horizons x tickers.  A
+    horizon is measured over the tickers with a score and both prices.
+
+    With --report_path, the measures are also written as lines of
+    "<label> <measure> <value>", label being the name of the future prices
+    file without extension:
+    - tickers, up_predicted, up_actual, correct: counts of tickers
+    - decile<i>: mean return of the i-th decile by ascending score
+    - low<n>, high<n>: mean return of the n lowest and highest scores
+    - pearson_ic, spearman_ic: correlation of scores and returns, and of
+      their ranks (tied values sharing their average rank)
+
+    With --resamples, the tickers of each horizon are also resampled with
+    replacement that many times, and the report adds the --confidence
+    interval of every decile, low and high mean return, as <measure>_lo and
+    <measure>_hi.  spread is decile K minus decile 1; spread_p is the share
+    of random permutations of the returns (as many as resamples) whose
+    spread is at least that, a one-sided p-value.
 """
 
 import argparse
 import logging
+import numpy as np
 import utils
 from os import path
 
 K = 10   # deciles
-# Top and bottom # stocks.
+# Top and bottom # stocks.  As logged, "top" are the lowest scores and "bot"
+# the highest; the report calls them low and high.
 T = [1, 5, 10, 20, 30]
 B = [-1, -5, -10, -20, -30]
+PRICE_BONUS = 0.01  # avoids division by 0
+
+COUNTS = ['tickers', 'up_predicted', 'up_actual', 'correct']
+
+# Returns of tickers from the current prices to each of the future prices.
+# Returns: (returns, valid), both horizons x tickers.  Invalid returns are 0.
+def returns_matrix(tickers, cp_map, fp_maps):
+  current = np.array([cp_map.get(t, np.nan) for t in tickers])
+  future = np.array([[fp_map.get(t, np.nan) for t in tickers]
+                     for fp_map in fp_maps]).reshape(len(fp_maps), -1)
+  valid = ~np.isnan(future) & ~np.isnan(current)[None, :]
+  returns = (future - current) / (current + PRICE_BONUS)
+  return np.where(valid, returns, 0.0), valid
+
+# Ranks of the valid values of each row, whose valid values are ascending.
+# Ranks start at 0, and tied values get their average rank.  Invalid
+# entries get -1.
+def sorted_ranks(values, valid):
+  rows = np.nonzero(valid)[0]
+  v = values[valid]
+  positions = (np.cumsum(valid, axis=1) - 1)[valid]
+  starts = np.ones(len(v), dtype=bool)
+  starts[1:] = (rows[1:] != rows[:-1]) | (v[1:] != v[:-1])
+  ties = np.cumsum(starts) - 1
+  average = np.bincount(ties, weights=positions) / np.bincount(ties)
+  ranks = np.full(values.shape, -1.0)
+  ranks[valid] = average[ties]
+  return ranks
+
+# Ranks of the valid values of each row, as in sorted_ranks().
+def row_ranks(values, valid):
+  order = np.argsort(np.where(valid, values, np.inf), axis=1, kind='stable')
+  ranks = np.empty(values.shape)
+  np.put_along_axis(ranks, order, sorted_ranks(
+      np.take_along_axis(values, order, axis=1),
+      np.take_along_axis(valid, order, axis=1)), axis=1)
+  return ranks
+
+# Pearson correlation of the valid entries of each row of x and y.
+def correlation(x, y, valid):
+  n = valid.sum(axis=1)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    dx = x - np.where(valid, x, 0.0).sum(axis=1, keepdims=True) / n[:, None]
+    dy = y - np.where(valid, y, 0.0).sum(axis=1, keepdims=True) / n[:, None]
+    dx, dy = np.where(valid, dx, 0.0), np.where(valid, dy, 0.0)
+    return ((dx * dy).sum(axis=1)
+            / np.sqrt((dx * dx).sum(axis=1) * (dy * dy).sum(axis=1)))
+
+# Mean of values over the entries of each row selected by mask, summed in
+# order.  Rows with fewer than count selected entries get NaN.
+def row_means(values, mask, count=0):
+  rows = np.nonzero(mask)[0]
+  sums = np.bincount(rows, weights=values[mask], minlength=len(values))
+  counts = np.bincount(rows, minlength=len(values))
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return np.where((counts > 0) & (counts >= count), sums / counts, np.nan)
+
+# Measures scores (tickers) against returns (horizons x tickers) over the
+# valid tickers of each horizon.  Deciles, low and high are computed over
+# the tickers ordered by ascending score, ties in order.
+# Returns: {measure: array}, each array having one row per horizon; see
+# COUNTS, and deciles (x K), low (x T), high (x B), pearson_ic and
+# spearman_ic.
+def evaluate(scores, returns, valid):
+  scores = np.asarray(scores, dtype=float)
+  returns = np.atleast_2d(returns)
+  valid = np.atleast_2d(valid)
+  order = np.argsort(scores, kind='stable')
+  x = np.broadcast_to(scores[order], returns.shape)
+  y = returns[:, order]
+  valid = valid[:, order]
+  ranks = np.cumsum(valid, axis=1) - 1  # by score, among the valid tickers
+  n = valid.sum(axis=1)
+
+  results = dict()
+  results['tickers'] = n
+  results['up_predicted'] = (valid & (x > 0)).sum(axis=1)
+  results['up_actual'] = (valid & (y > 0)).sum(axis=1)
+  results['correct'] = (valid & ((x > 0) == (y > 0))).sum(axis=1)
+
+  # The last decile takes the remainder.
+  bucket_size = n // K
+  buckets = np.minimum(ranks // np.maximum(bucket_size, 1)[:, None], K - 1)
+  results['deciles'] = np.stack(
+      [row_means(y, valid & (buckets == i)) for i in range(K)], axis=1)
+  results['deciles'][bucket_size == 0] = np.nan
+  results['low'] = np.stack(
+      [row_means(y, valid & (ranks < p), p) for p in T], axis=1)
+  results['high'] = np.stack(
+      [row_means(y, valid & (ranks >= (n + p)[:, None]), -p) for p in B],
+      axis=1)
+
+  results['pearson_ic'] = correlation(x, y, valid)
+  # Scores are already in order.
+  results['spearman_ic'] = correlation(sorted_ranks(x, valid),
+                                       row_ranks(y, valid), valid)
+  return results
+
+# Decile, low and high mean returns of each row of y, whose columns are in
+# ascending score order, as in evaluate().
+# Returns: (deciles, low, high), rows x K, T and B.
+def ranked_means(y):
+  r, n = y.shape
+  csum = np.zeros((r, n + 1))
+  np.cumsum(y, axis=1, out=csum[:, 1:])
+  bucket_size = n // K
+  bounds = [i * bucket_size for i in range(K)] + [n]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    deciles = np.stack([(csum[:, bounds[i+1]] - csum[:, bounds[i]])
+                        / (bounds[i+1] - bounds[i]) for i in range(K)], axis=1)
+  if bucket_size == 0:
+    deciles[:] = np.nan
+  nan = np.full(r, np.nan)
+  low = np.stack([csum[:, p] / p if p <= n else nan for p in T], axis=1)
+  high = np.stack([(csum[:, n] - csum[:, n + p]) / -p if -p <= n else nan
+                   for p in B], axis=1)
+  return deciles, low, high
+
+# Bootstraps the measures of evaluate() for every horizon.  Each batch of
+# resamples is a matrix of ticker indexes: sorting the indexes of a
+# resample orders it by score, as the tickers are kept in score order.
+# Permutations of the returns give the null distribution of the spread.
+# Returns: {measure: array}, with deciles_ci (horizons x K x 2), low_ci and
+# high_ci (x T and B x 2), spread (horizons), spread_ci (x 2) and spread_p.
+def bootstrap(scores, returns, valid, resamples, confidence, rng,
+              batch_size=1000):
+  assert resamples > 0 and 0 < confidence < 1
+  order = np.argsort(np.asarray(scores, dtype=float), kind='stable')
+  returns = np.atleast_2d(returns)[:, order]
+  valid = np.atleast_2d(valid)[:, order]
+  h = len(returns)
+  q = [(1 - confidence) / 2, (1 + confidence) / 2]
+  results = {'deciles_ci': np.full((h, K, 2), np.nan),
+             'low_ci': np.full((h, len(T), 2), np.nan),
+             'high_ci': np.full((h, len(B), 2), np.nan),
+             'spread': np.full(h, np.nan),
+             'spread_ci': np.full((h, 2), np.nan),
+             'spread_p': np.full(h, np.nan)}
+  for i in range(h):
+    y = returns[i][valid[i]]
+    n = len(y)
+    if n < K:
+      continue
+    deciles, _, _ = ranked_means(y[None, :])
+    spread = deciles[0, K - 1] - deciles[0, 0]
+    samples = [[], [], []]
+    exceeded = 0
+    for begin in range(0, resamples, batch_size):
+      size = min(batch_size, resamples - begin)
+      index = np.sort(rng.integers(0, n, size=(size, n)), axis=1)
+      for samples_of, means in zip(samples, ranked_means(y[index])):
+        samples_of.append(means)
+      index = rng.permuted(np.broadcast_to(np.arange(n), (size, n)), axis=1)
+      null, _, _ = ranked_means(y[index])
+      exceeded += np.count_nonzero(null[:, K - 1] - null[:, 0] >= spread)
+    deciles, low, high = [np.concatenate(s) for s in samples]
+    with np.errstate(invalid='ignore'):
+      results['deciles_ci'][i] = np.quantile(deciles, q, axis=0).T
+      results['low_ci'][i] = np.quantile(low, q, axis=0).T
+      results['high_ci'][i] = np.quantile(high, q, axis=0).T
+      results['spread_ci'][i] = np.quantile(
+          deciles[:, K - 1] - deciles[:, 0], q)
+    results['spread'][i] = spread
+    results['spread_p'][i] = (exceeded + 1) / (resamples + 1)
+  return results
+
+def log_results(scores, returns, valid, results, h):
+  n = results['tickers'][h]
+  logging.info('%d tickers in this test' % n)
+  logging.info('%d of %d are predicted to go up'
+      % (results['up_predicted'][h], n))
+  logging.info('%d of %d did go up' % (results['up_actual'][h], n))
+  logging.info('%d of %d correct signs (%.2f%%)'
+      % (results['correct'][h], n, 100.0 * results['correct'][h] / n))
+  bucket_size = int(n / K)
+  for i in range(K):
+    count = bucket_size if i < K - 1 else n - (K - 1) * bucket_size
+    logging.info('decile %d: %d stocks, mean return = %.2f%%'
+        % (i+1, count, results['deciles'][h][i] * 100))
+  logging.info('Mean return for top %s is %s'
+      % (T, results['low'][h].tolist()))
+  logging.info('Mean return for bot %s is %s'
+      % (B, results['high'][h].tolist()))
+  logging.info('Pearson IC = %f, Spearman IC = %f'
+      % (results['pearson_ic'][h], results['spearman_ic'][h]))
+  if 'spread_p' in results:
+    logging.info('decile %d - decile 1 = %.2f%%, interval = [%.2f%%, %.2f%%],'
+        ' p = %f' % (K, results['spread'][h] * 100,
+                     results['spread_ci'][h][0] * 100,
+                     results['spread_ci'][h][1] * 100, results['spread_p'][h]))
+
+  # Tickers by ascending return, ties by ascending score.
+  order = np.argsort(scores, kind='stable')
+  s = scores[order][valid[h][order]]
+  r = returns[h][order][valid[h][order]]
+  by_return = np.argsort(r, kind='stable')
+  gains, gain_scores = r[by_return].tolist(), s[by_return].tolist()
+  logging.info('Top 10 gains: %s, average: %f'
+      % (gains[-10:], sum(gains[-10:])/10))
+  logging.info('Top 10 scores: %s, average: %f'
+      % (gain_scores[-10:], sum(gain_scores[-10:])/10))
+  logging.info('Bot 10 gains: %s, average: %f'
+      % (gains[:10], sum(gains[:10])/10))
+  logging.info('Bot 10 scores: %s, average: %f'
+      % (gain_scores[:10], sum(gain_scores[:10])/10))
 
-def compute_return(rs, r_map, positions):
-  output = []
-  for p in positions:
-    assert p != 0
-    if p > 0: r = range(p)
-    else: r = range(len(rs)+p, len(rs))
-    s, c = 0.0, 0
-    for i in r:
-      s += r_map[rs[i][0]]
-      c += 1
-    if p > 0: assert c == p
-    else: assert c == -p
-    output.append(s/c)
-  return output
+def write_report(labels, results, report_path):
+  with open(report_path, 'w') as fp:
+    def write(h, name, value, ci=None):
+      print('%s %s %f' % (labels[h], name, value), file=fp)
+      if ci is not None:
+        print('%s %s_lo %f' % (labels[h], name, ci[0]), file=fp)
+        print('%s %s_hi %f' % (labels[h], name, ci[1]), file=fp)
+    bootstrapped = 'spread_p' in results
+    for h in range(len(labels)):
+      for name in COUNTS:
+        print('%s %s %d' % (labels[h], name, results[name][h]), file=fp)
+      for i in range(K):
+        write(h, 'decile%d' % (i+1), results['deciles'][h][i],
+              results['deciles_ci'][h][i] if bootstrapped else None)
+      for j in range(len(T)):
+        write(h, 'low%d' % T[j], results['low'][h][j],
+              results['low_ci'][h][j] if bootstrapped else None)
+      for j in range(len(B)):
+        write(h, 'high%d' % -B[j], results['high'][h][j],
+              results['high_ci'][h][j] if bootstrapped else None)
+      for name in ['pearson_ic', 'spearman_ic']:
+        write(h, name, results[name][h])
+      if bootstrapped:
+        write(h, 'spread', results['spread'][h], results['spread_ci'][h])
+        write(h, 'spread_p', results['spread_p'][h])
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--current_prices_path', required=True)
-  parser.add_argument('--future_prices_path', required=True)
+  # Repeat for more horizons.
+  parser.add_argument('--future_prices_path', action='append', required=True)
   parser.add_argument('--scores_path', required=True)
+  parser.add_argument('--report_path', default='')
+  # Number of bootstrap resamples and permutations; 0 disables them.
+  parser.add_argument('--resamples', default='0')
+  parser.add_argument('--confidence', default='0.95')
+  parser.add_argument('--seed', default='0')
   parser.add_argument('--verbose', action='store_true')
   args = parser.parse_args()
 
   utils.setup_logging(args.verbose)
 
   cp_map = utils.read_map(args.current_prices_path)
-  fp_map = utils.read_map(args.future_prices_path)
+  fp_maps = [utils.read_map(p) for p in args.future_prices_path]
   s_map = utils.read_map(args.scores_path)
-  tickers = cp_map.keys() & fp_map.keys() & s_map.keys()
 
-  logging.info('%d tickers in this test' % len(tickers))
   scores = s_map.values()
   maxs, mins, means = max(scores), min(scores), sum(scores)/len(scores)
   logging.info('max score = %f, min score = %f, mean score = %f' %
       (maxs, mins, means))
 
-  r_map = dict()
-  for t in tickers:
-    r_map[t] = (fp_map[t] - cp_map[t]) / (cp_map[t] + 0.01)  # avoid div-by-0
-
-  ups, rups, corrects = 0, 0, 0
-  for t in tickers:
-    if (s_map[t] > 0) == (r_map[t] > 0):
-      corrects += 1
-    if s_map[t] > 0:
-      ups += 1
-    if r_map[t] > 0:
-      rups += 1
-  logging.info('%d of %d are predicted to go up' % (ups, len(tickers)))
-  logging.info('%d of %d did go up' % (rups, len(tickers)))
-  logging.info('%d of %d correct signs (%.2f%%)'
-      % (corrects, len(tickers), 100.0 * corrects / len(tickers)))
+  tickers = list(s_map.keys())
+  scores = np.array([s_map[t] for t in tickers])
+  returns, valid = returns_matrix(tickers, cp_map, fp_maps)
+  results = evaluate(scores, returns, valid)
+  resamples = int(args.resamples)
+  if resamples > 0:
+    results.update(bootstrap(scores, returns, valid, resamples,
+                             float(args.confidence),
+                             np.random.default_rng(int(args.seed))))
 
-  rs = [(t, s) for t, s in s_map.items()]
-  rs.sort(key=lambda x: x[1])
-  bucket_size = int(len(tickers) / K)
-  for i in range(K):
-    f = i * bucket_size
-    t = f + bucket_size
-    if i == K - 1: t = len(tickers)
-
-    meanr, count = 0.0, 0
-    for j in range(f, t):
-      r = r_map[rs[j][0]]
-      meanr += r
-      count += 1
-    meanr /= count
-    logging.info('decile %d: %d stocks, mean return = %.2f%%'
-        % (i+1, count, meanr * 100))
-  tr = compute_return(rs, r_map, T)
-  br = compute_return(rs, r_map, B)
-  logging.info('Mean return for top %s is %s' % (T, tr))
-  logging.info('Mean return for bot %s is %s' % (B, br))
-
-  rss = [(p[0], p[1], r_map[p[0]]) for p in rs]
-  rss.sort(key=lambda x: x[2])
-  logging.info('Top 10 gains: %s, average: %f'
-      % ([x[2] for x in rss[-10:]], sum([x[2] for x in rss[-10:]])/10))
-  logging.info('Top 10 scores: %s, average: %f'
-      % ([x[1] for x in rss[-10:]], sum([x[1] for x in rss[-10:]])/10))
-  logging.info('Bot 10 gains: %s, average: %f'
-      % ([x[2] for x in rss[:10]], sum([x[2] for x in rss[:10]])/10))
-  logging.info('Bot 10 scores: %s, average: %f'
-      % ([x[1] for x in rss[:10]], sum([x[1] for x in rss[:10]])/10))
+  labels = [path.splitext(path.basename(p))[0]
+            for p in args.future_prices_path]
+  for h in range(len(labels)):
+    logging.info('Measuring against %s' % args.future_prices_path[h])
+    log_results(scores, returns, valid, results, h)
+  if args.report_path != '':
+    write_report(labels, results, args.report_path)
 
 if __name__ == '__main__':
   main()
-
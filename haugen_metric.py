@@ -1,126 +1,182 @@
 #!/usr/local/bin/python3
 
-""" Extracts certain metric from certain date.
+""" Extracts certain metrics from certain dates.
+
+    Either extracts a single metric (--metric, --k, --skip_empty and
+    --output_path), or any number of metrics given as repeated
+    --spec=<metric>:<k>:<skip_empty>:<output_path> flags, where skip_empty is
+    0 or 1.  --yyyy_mm can be a comma-separated list of dates, in which case
+    each output path must contain "{yyyy_mm}", which is replaced by the date.
+    All outputs are computed from a single scan of the input directory.
 """
 
 import argparse
+import asof_index
 import logging
 import utils
 from os import path
 
-def distance(ym1, ym2):
-  y1, m1 = ym1.split('-')
-  y2, m2 = ym2.split('-')
-  y1, m1 = int(y1), int(m1)
-  y2, m2 = int(y2), int(m2)
-  return (y1 - y2) * 12 + m1 - m2
+DATE_PLACEHOLDER = '{yyyy_mm}'
+
+# Finds the item indexes of the k most recent quarters at or before yyyy_mm,
+# where index is the as-of index of the report dates (items[1:] of the date
+# line of a parsed report).
+# Returns: (indexes, warning), where indexes is None if there is no valid
+# window and warning tells why.
+def find_quarters(index, yyyy_mm, k):
+  n = int(index.counts[0]) + 1
+  # We require n - 1 >= k + 1:
+  # n - 1: the number of quarters for which data is available
+  # k: the number of quarters for which data is needed
+  # We further need k + 1 quarters, at least for the dates, because we
+  # want to ensure that the previous (k + 1)th quarter deed ends at a
+  # proper date.  Otherwise the first quarter we use is not a valid span.
+  #
+  # UPDATE: now require n - 1 >= k.  We no longer care about the validity
+  # of the previous quarter so that we can train on more data.
+  if n - 1 < k:
+    return None, ('Not enough quarters for aggregation:'
+                  ' wanted at least %d, saw %d' % (k, n-1))
+  # Position of the most recent quarter.  We need k quarters up to and
+  # including it.
+  month = utils.month_ordinal(yyyy_mm)
+  latest = index.latest(0, month)
+  if latest < k - 1:
+    return None, 'Not enough recent quarters for aggregation'
+  # Item indexes are 1-based because items[0] is 'date'.
+  indexes = list(range(latest - k + 2, latest + 2))
+  logging.debug('Index is %s' % indexes)
+  if month - index.date(0, latest) > 6:
+    return None, 'The most recent quarter is not recent enough'
+  if index.run_length(0, latest) < k:
+    return None, 'Data is not quarterly'
+  return indexes, None
+
+# Aggregates a metric line over the quarter indexes.  Returns None if the
+# line has empty values and skip_empty is set.
+def aggregate(items, indexes, skip_empty):
+  metric = 0.0
+  has_empty = False
+  for jj in indexes:
+    if items[jj] == '':
+      has_empty = True
+      continue
+    metric += float(items[jj])
+  if has_empty and skip_empty:
+    return None
+  return metric
+
+def parse_spec(spec):
+  metric, k, skip_empty, output_path = spec.split(':', 3)
+  assert skip_empty in ('0', '1'), 'skip_empty must be 0 or 1: %s' % spec
+  return metric, int(k), skip_empty == '1', output_path
+
+# Extracts metrics of tickers from input_dir for every spec and date, where
+# a spec is (metric, k, skip_empty).
+# Returns: {(spec index, date): {ticker: value}}.
+def extract(tickers, input_dir, dates, specs):
+  # (spec index, date) -> {ticker: value}
+  metric_maps = dict()
+  for s in range(len(specs)):
+    for date in dates:
+      metric_maps[(s, date)] = dict()
+  for i in range(len(tickers)):
+    ticker = tickers[i]
+    logging.info('%d/%d: %s' % (i+1, len(tickers), ticker))
+    input_path = '%s/%s.csv' % (input_dir, ticker.replace('^', '_'))
+    if not path.isfile(input_path):
+      logging.warning('Input file is missing: %s' % input_path)
+      continue
+
+    with open(input_path, 'r') as fp:
+      lines = fp.read().splitlines()
+    assert len(lines) > 0
+    items = lines[0].split(',')
+    n = len(items)
+    assert n > 0
+    assert items[0] == 'date'
+    rows = dict()
+    for j in range(1, len(lines)):
+      row = lines[j].split(',')
+      assert len(row) == n
+      if row[0] not in rows:
+        rows[row[0]] = row
+
+    # The quarter window only depends on (date, k), so it is shared by all
+    # specs with the same k.
+    try:
+      index = asof_index.AsOfIndex.from_dates([items[1:]])
+    except ValueError as e:
+      logging.warning('Skipping %s: %s' % (ticker, e))
+      continue
+    windows = dict()
+    for s in range(len(specs)):
+      metric, k, skip_empty = specs[s]
+      for date in dates:
+        if (date, k) not in windows:
+          windows[(date, k)] = find_quarters(index, date, k)
+          indexes, warning = windows[(date, k)]
+          if indexes is None:
+            logging.warning('%s for %s (%s, k=%d)'
+                            % (warning, ticker, date, k))
+        indexes, _ = windows[(date, k)]
+        if indexes is None:
+          continue
+        if metric not in rows:
+          logging.warning('Could not find %s for %s' % (metric, ticker))
+          continue
+        value = aggregate(rows[metric], indexes, skip_empty)
+        if value is None:
+          logging.warning('Could not find %s for %s' % (metric, ticker))
+          continue
+        metric_maps[(s, date)][ticker] = value
+  return metric_maps
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--ticker_file', required=True)
   parser.add_argument('--input_dir', required=True)
-  parser.add_argument('--metric', required=True)
+  parser.add_argument('--metric', default='')
+  # One or more dates, separated by commas.
   parser.add_argument('--yyyy_mm', required=True)
   # Aggregate the last k quarters' data.
   parser.add_argument('--k', default='1')
-  parser.add_argument('--output_path', required=True)
+  parser.add_argument('--output_path', default='')
   parser.add_argument('--skip_empty', action='store_true')
+  # <metric>:<k>:<skip_empty>:<output_path>, repeatable.
+  parser.add_argument('--spec', action='append', default=[])
   parser.add_argument('--verbose', action='store_true')
   args = parser.parse_args()
 
   utils.setup_logging(args.verbose)
 
-  k = int(args.k)
-  assert k > 0
+  specs = [parse_spec(spec) for spec in args.spec]
+  if args.metric != '':
+    assert args.output_path != '', '--output_path is required with --metric'
+    specs.append((args.metric, int(args.k), args.skip_empty,
+                  args.output_path))
+  assert len(specs) > 0, 'either --metric or --spec is required'
+  dates = args.yyyy_mm.split(',')
+  for metric, k, skip_empty, output_path in specs:
+    assert k > 0
+    assert len(dates) == 1 or output_path.find(DATE_PLACEHOLDER) >= 0, (
+        'output path must contain %s for multiple dates: %s'
+        % (DATE_PLACEHOLDER, output_path))
 
   # Tickers are listed one per line.
   with open(args.ticker_file, 'r') as fp:
     tickers = fp.read().splitlines()
   logging.info('Processing %d tickers' % len(tickers))
 
-  metric_map = dict()
-  for i in range(len(tickers)):
-    ticker = tickers[i]
-    logging.info('%d/%d: %s' % (i+1, len(tickers), ticker))
-    input_path = '%s/%s.csv' % (args.input_dir, ticker.replace('^', '_'))
-    if not path.isfile(input_path):
-      logging.warning('Input file is missing: %s' % input_path)
-      continue
-
-    with open(input_path, 'r') as fp:
-      lines = fp.read().splitlines()
-    assert len(lines) > 0
-    items = lines[0].split(',')
-    n = len(items)
-    assert n > 0
-    assert items[0] == 'date'
-    # We require n - 1 >= k + 1:
-    # n - 1: the number of quarters for which data is available
-    # k: the number of quarters for which data is needed
-    # We further need k + 1 quarters, at least for the dates, because we
-    # want to ensure that the previous (k + 1)th quarter deed ends at a
-    # proper date.  Otherwise the first quarter we use is not a valid span.
-    #
-    # UPDATE: now require n - 1 >= k.  We no longer care about the validity
-    # of the previous quarter so that we can train on more data.
-    if n - 1 < k:
-      logging.warning('Not enough quarters for aggregation:'
-                      ' wanted at least %d, saw %d' % (k, n-1))
-      continue
-    indexes = None
-    for j in range(len(items) - 1, 0, -1):
-      # Sanity check of format validity.
-      y, m = items[j].split('-')
-      y, m = int(y), int(m)
-      if items[j] <= args.yyyy_mm:
-        # We found the most recent quarter.  Now push the most recent k
-        # quarters in.  Bail if we have less than k left.
-        if j >= k:  # j >= k + 1  # before UPDATE
-          indexes = list(range(j-k+1, j+1))
-        break
-    if indexes is None:
-      logging.warning('Not enough recent quarters for aggregation')
-      continue
-    logging.debug('Index is %s' % indexes)
-    assert len(indexes) == k
-    if distance(args.yyyy_mm, items[indexes[-1]]) > 6:
-      logging.warning('The most recent quarter is not recent enough')
-      continue
-    is_quarterly = True
-    #for j in indexes:
-    #  if distance(items[j], items[j-1]) != 3:
-    #    is_quarterly = False
-    #    break
-    for j in range(len(indexes) - 1):
-      if distance(items[indexes[j+1]], items[indexes[j]]) != 3:
-        is_quarterly = False
-        break
-    if not is_quarterly:
-      logging.warning('Data is not quarterly')
-      continue
-    found = False
-    for j in range(1, len(lines)):
-      items = lines[j].split(',')
-      assert len(items) == n
-      if items[0] == args.metric:
-        metric = 0.0
-        has_empty = False
-        for jj in indexes:
-          if items[jj] == '':
-            has_empty = True
-            continue
-          metric += float(items[jj])
-        if has_empty and args.skip_empty:
-          break
-        metric_map[ticker] = float(metric)
-        found = True
-        break
-    if not found:
-      logging.warning('Could not find %s for %s' % (args.metric, ticker))
-  with open(args.output_path, 'w') as fp:
-    for ticker in sorted(metric_map.keys()):
-      print('%s %f' % (ticker, metric_map[ticker]), file=fp)
+  metric_maps = extract(tickers, args.input_dir, dates,
+                        [spec[:3] for spec in specs])
+  for s in range(len(specs)):
+    for date in dates:
+      output_path = specs[s][3].replace(DATE_PLACEHOLDER, date)
+      metric_map = metric_maps[(s, date)]
+      with open(output_path, 'w') as fp:
+        for ticker in sorted(metric_map.keys()):
+          print('%s %f' % (ticker, metric_map[ticker]), file=fp)
 
 if __name__ == '__main__':
   main()
-
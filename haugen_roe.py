@@ -1,6 +1,7 @@
 #!/usr/local/bin/python3
 
 import argparse
+import factor_engine
 import logging
 import utils
 from os import path
@@ -17,12 +18,7 @@ def main():
 
   ni_map = utils.read_map(args.net_income_path)
   e_map = utils.read_map(args.total_equity_path)
-  tickers = ni_map.keys() & e_map.keys()
-
-  with open(args.output_path, 'w') as fp:
-    for ticker in sorted(tickers):
-      output = ni_map[ticker] / e_map[ticker]
-      print('%s %f' % (ticker, output), file=fp)
+  utils.write_map(factor_engine.roe(ni_map, e_map), args.output_path)
 
 if __name__ == '__main__':
   main()
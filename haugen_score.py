@@ -1,20 +1,21 @@
 #!/usr/local/bin/python3
 
+""" Scores stocks as the weighted sum of their factors.
+
+    By default the weights are the averaged payoffs of table 1 of Haugen's
+    paper.  With --weights_path, every weight set of the file (see
+    factor_engine.read_weights()) is scored in one matrix multiply, and
+    --output_path must contain "{name}", which is replaced by the name of
+    the weight set.
+"""
+
 import argparse
+import factor_engine
 import logging
 import utils
 from os import path
 
-# From table 1 of Haugen's paper.
-ER1 = ((-.97) + (-.72))/2
-ER12 = (.52 + .52) / 2
-TV2MC = ((-.35) + (-.2)) / 2
-ER2 = ((-.2) + (-.11)) / 2
-E2P = (.27 + .26) / 2
-ROE = (.24 + .13) / 2
-B2P = (.35 + .39) / 2
-ER6 = (.24 + .19) / 2
-CF2P = (.13 + .26) / 2
+NAME_PLACEHOLDER = '{name}'
 
 def main():
   parser = argparse.ArgumentParser()
@@ -27,6 +28,7 @@ def main():
   parser.add_argument('--b2p_path', required=True)
   parser.add_argument('--er6_path', required=True)
   parser.add_argument('--cf2p_path', required=True)
+  parser.add_argument('--weights_path', default='')
   parser.add_argument('--output_path', required=True)
   parser.add_argument('--verbose', action='store_true')
   args = parser.parse_args()
@@ -42,25 +44,25 @@ def main():
   b2p_map = utils.read_map(args.b2p_path)
   er6_map = utils.read_map(args.er6_path)
   cf2p_map = utils.read_map(args.cf2p_path)
-  tickers = (er1_map.keys() & er12_map.keys() & tv2mc_map.keys()
-             & er2_map.keys() & e2p_map.keys() & roe_map.keys()
-             & b2p_map.keys() & er6_map.keys() & cf2p_map.keys())
-  logging.info('%d tickers' % len(tickers))
-  logging.info('total weight: %f' %
-      (ER1 + ER12 + TV2MC + ER2 + E2P + ROE + B2P + ER6 + CF2P))
+  if args.weights_path == '':
+    s_map = factor_engine.score(er1_map, er12_map, tv2mc_map, er2_map,
+                                e2p_map, roe_map, b2p_map, er6_map, cf2p_map)
+    utils.write_map(s_map, args.output_path)
+    return
 
-  with open(args.output_path, 'w') as fp:
-    for t in sorted(tickers):
-      score = (er1_map[t] * ER1
-               + er12_map[t] * ER12
-               + tv2mc_map[t] * TV2MC
-               + er2_map[t] * ER2
-               + e2p_map[t] * E2P
-               + roe_map[t] * ROE
-               + b2p_map[t] * B2P
-               + er6_map[t] * ER6
-               + cf2p_map[t] * CF2P) / 100  # accounting for %
-      print('%s %f' % (t, score), file=fp)
+  assert args.output_path.find(NAME_PLACEHOLDER) >= 0, (
+      '--output_path must contain %s with --weights_path' % NAME_PLACEHOLDER)
+  names, weights = factor_engine.read_weights(args.weights_path)
+  maps = {'er1': er1_map, 'er12': er12_map, 'tv2mc': tv2mc_map,
+          'er2': er2_map, 'e2p': e2p_map, 'roe': roe_map, 'b2p': b2p_map,
+          'er6': er6_map, 'cf2p': cf2p_map}
+  universe = factor_engine.Universe(t for m in maps.values() for t in m)
+  scores, valid = factor_engine.score_matrix(universe, maps, weights)
+  logging.info('Scored %d tickers with %d weight sets'
+               % (valid.sum(), len(names)))
+  for n in range(len(names)):
+    utils.write_map(universe.to_map(scores[n], valid),
+                    args.output_path.replace(NAME_PLACEHOLDER, names[n]))
 
 if __name__ == '__main__':
   main()
@@ -14,21 +14,87 @@
 """
 
 import argparse
+import daily_prices
 import logging
+import numpy as np
+import price_store
 import utils
+import volume_cube
 from os import path
 
-def distance(ym1, ym2):
-  y1, m1 = ym1.split('-')
-  y2, m2 = ym2.split('-')
-  y1, m1 = int(y1), int(m1)
-  y2, m2 = int(y2), int(m2)
-  return (y1 - y2) * 12 + m1 - m2
+def read_cube(cube_dir, tickers, yyyy_mm, k):
+  cube = volume_cube.Cube(cube_dir)
+  volumes, valid = cube.trailing_volume([utils.month_ordinal(yyyy_mm)], k)
+  volume_map = dict()
+  for ticker in tickers:
+    if ticker not in cube.ticker_index:
+      logging.warning('Ticker is missing from cube: %s' % ticker)
+      continue
+    i = cube.ticker_index[ticker]
+    if not valid[i, 0]:
+      logging.warning('Could not find enough data for %s' % ticker)
+      continue
+    volume_map[ticker] = float(volumes[i, 0])
+  return volume_map
+
+def read_prices(price_dir, tickers, yyyy_mm, k):
+  volume_map = dict()
+  for i in range(len(tickers)):
+    ticker = tickers[i]
+    logging.info('%d/%d: %s' % (i+1, len(tickers), ticker))
+    input_path = '%s/%s.csv' % (price_dir, ticker.replace('^', '_'))
+    if not path.isfile(input_path):
+      logging.warning('Input file is missing: %s' % input_path)
+      continue
+
+    vmap = dict()
+    for d, o, h, l, c, v, a in daily_prices.read_trailing_rows(
+        input_path, yyyy_mm, k):
+      d = d[:7]
+      v = float(v) * float(a)
+      if d in vmap: vmap[d] += v
+      else: vmap[d] = v
+    assert len(vmap) <= k
+    if len(vmap) < k:  #max(1, k/2):
+      logging.warning('Could not find enough data for %s' % ticker)
+      continue
+    volume_map[ticker] = sum(vmap.values()) / len(vmap)
+  return volume_map
+
+def read_store(store_dir, tickers, yyyy_mm, k):
+  store = price_store.Store(store_dir)
+  target = utils.month_ordinal(yyyy_mm)
+  from_day = price_store.month_first_day(target - k + 1)
+  to_day = price_store.month_first_day(target + 1) - 1
+  volume_map = dict()
+  for ticker in tickers:
+    if ticker not in store.ticker_index:
+      logging.warning('Ticker is missing from store: %s' % ticker)
+      continue
+    s = store.window(store.ticker_index[ticker], from_day, to_day)
+    # Newest first, the same summation order as read_prices().
+    months = price_store.day_months(store.days[s])[::-1]
+    v = (store.columns['volume'][s] * store.columns['adjclose'][s])[::-1]
+    starts = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+    if len(months) == 0 or len(starts) < k:
+      logging.warning('Could not find enough data for %s' % ticker)
+      continue
+    v = v.tolist()
+    ends = list(starts[1:]) + [len(v)]
+    vmap = [sum(v[b:e]) for b, e in zip(starts, ends)]
+    volume_map[ticker] = sum(vmap) / len(vmap)
+  return volume_map
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--ticker_file', required=True)
-  parser.add_argument('--price_dir', required=True)
+  parser.add_argument('--price_dir', default='')
+  # If set, volumes are looked up in a cube built by volume_cube.py instead
+  # of being aggregated from --price_dir.
+  parser.add_argument('--cube_dir', default='')
+  # If set, daily prices are read from a store built by price_store.py
+  # instead of --price_dir.
+  parser.add_argument('--store_dir', default='')
   parser.add_argument('--yyyy_mm', required=True)
   parser.add_argument('--k', default='12')
   parser.add_argument('--output_path', required=True)
@@ -45,32 +111,14 @@ def main():
   k = int(args.k)
   assert k > 0
 
-  volume_map = dict()
-  for i in range(len(tickers)):
-    ticker = tickers[i]
-    logging.info('%d/%d: %s' % (i+1, len(tickers), ticker))
-    input_path = '%s/%s.csv' % (args.price_dir, ticker.replace('^', '_'))
-    if not path.isfile(input_path):
-      logging.warning('Input file is missing: %s' % input_path)
-      continue
-
-    with open(input_path, 'r') as fp:
-      lines = fp.read().splitlines()
-    vmap = dict()
-    assert len(lines) > 0
-    for j in range(1, len(lines)):
-      d, o, h, l, c, v, a = lines[j].split(',')
-      d = d[:7]
-      if args.yyyy_mm < d: continue
-      if distance(args.yyyy_mm, d) >= k: break
-      v = float(v) * float(a)
-      if d in vmap: vmap[d] += v
-      else: vmap[d] = v
-    assert len(vmap) <= k
-    if len(vmap) < k:  #max(1, k/2):
-      logging.warning('Could not find enough data for %s' % ticker)
-      continue
-    volume_map[ticker] = sum(vmap.values()) / len(vmap)
+  assert args.price_dir != '' or args.cube_dir != '' or args.store_dir != '', (
+      'one of --price_dir, --cube_dir and --store_dir is required')
+  if args.cube_dir != '':
+    volume_map = read_cube(args.cube_dir, tickers, args.yyyy_mm, k)
+  elif args.store_dir != '':
+    volume_map = read_store(args.store_dir, tickers, args.yyyy_mm, k)
+  else:
+    volume_map = read_prices(args.price_dir, tickers, args.yyyy_mm, k)
 
   with open(args.output_path, 'w') as fp:
     for ticker in sorted(volume_map.keys()):
@@ -78,4 +126,3 @@ def main():
 
 if __name__ == '__main__':
   main()
-
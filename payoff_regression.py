@@ -0,0 +1,140 @@
+#!/usr/local/bin/python3
+
+""" Estimates factor payoffs by cross-sectional regression, as in Haugen.
+
+    For every month, next month's excess returns are regressed on the
+    factors of factor_engine.SCORE_FACTORS (plus an intercept) across all
+    tickers with complete data.  All monthly regressions are solved as one
+    batch of normal equations.  The payoffs are scaled by 100, like the
+    table 1 payoffs of Haugen's paper that haugen_score.py divides by 100.
+
+    The output is a weights file for haugen_score.py --weights_path (see
+    factor_engine.read_weights()).  The weight set of a month is the average
+    payoff of the --window months before it, so it only uses returns known
+    at the end of that month.
+
+    The excess return factors look back up to 12 months (see
+    factor_engine.ER_HORIZONS), so market samples are needed from 12 months
+    before --from_yyyy_mm to the month after --to_yyyy_mm.  Months without
+    them are skipped with a warning and count as months without payoffs.
+"""
+
+import argparse
+import factor_engine
+import factor_panel
+import logging
+import numpy as np
+import utils
+
+# Solves y ~ X b by least squares for every month at once.  X is tickers x
+# months x factors, y and valid are tickers x months.  An intercept is
+# added.  Months with no more valid tickers than unknowns get NaN.
+# Returns: months x factors payoffs (without the intercept).
+def regress(x, y, valid):
+  t, m, f = x.shape
+  design = np.concatenate([np.ones((t, m, 1)), x], axis=2)
+  design = np.where(valid[:, :, None], design, 0.0)
+  y = np.where(valid, y, 0.0)
+  counts = valid.sum(axis=0)
+  # Factors differ in scale by orders of magnitude, so columns are scaled
+  # to unit root mean square before solving, and payoffs scaled back.
+  scale = np.sqrt(np.einsum('tmf,tmf->mf', design, design)
+                  / np.maximum(counts, 1)[:, None])
+  scale = np.where(scale > 0, scale, 1.0)
+  design = design / scale[None, :, :]
+  xtx = np.einsum('tmf,tmg->mfg', design, design)
+  xty = np.einsum('tmf,tm->mf', design, y)
+  # The pseudo-inverse leaves degenerate directions at 0 instead of failing.
+  payoffs = np.einsum('mfg,mg->mf', np.linalg.pinv(xtx), xty) / scale
+  return np.where((counts > f + 1)[:, None], payoffs[:, 1:], np.nan)
+
+# Averages monthly payoffs over the window months before each month,
+# ignoring months without payoffs.
+# Returns: (weights, valid), weights being months x factors.
+def trailing_average(payoffs, window):
+  assert window > 0
+  ok = ~np.isnan(payoffs).any(axis=1)
+  zero = np.zeros((1, payoffs.shape[1]))
+  csum = np.concatenate([zero, np.cumsum(np.where(ok[:, None], payoffs, 0.0),
+                                         axis=0)])
+  ccount = np.concatenate([[0], np.cumsum(ok)])
+  end = np.arange(len(payoffs))  # months before, exclusive of the month
+  begin = np.maximum(end - window, 0)
+  counts = ccount[end] - ccount[begin]
+  with np.errstate(invalid='ignore'):
+    weights = (csum[end] - csum[begin]) / counts[:, None]
+  return weights, counts > 0
+
+def write_weights(months, weights, valid, output_path):
+  with open(output_path, 'w') as fp:
+    print(' '.join(factor_engine.SCORE_FACTORS), file=fp)
+    for j in np.flatnonzero(valid):
+      print('%s %s' % (utils.month_string(months[j]),
+                       ' '.join('%f' % w for w in weights[j])), file=fp)
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--ticker_file', required=True)
+  parser.add_argument('--price_sample_dir', required=True)
+  parser.add_argument('--market_sample_path', required=True)
+  # Built by fundamentals_store.py and volume_cube.py.
+  parser.add_argument('--store_dir', required=True)
+  parser.add_argument('--cube_dir', required=True)
+  # Inclusive range of months to regress.  Market samples are needed from
+  # 12 months before --from_yyyy_mm to the month after --to_yyyy_mm.
+  parser.add_argument('--from_yyyy_mm', required=True)
+  parser.add_argument('--to_yyyy_mm', required=True)
+  parser.add_argument('--window', default='12')
+  # Weight sets, one per month after the first.
+  parser.add_argument('--output_path', required=True)
+  # If set, monthly payoffs are written here in the same format.
+  parser.add_argument('--payoffs_path', default='')
+  parser.add_argument('--verbose', action='store_true')
+  args = parser.parse_args()
+
+  utils.setup_logging(args.verbose)
+
+  # Tickers are listed one per line.
+  with open(args.ticker_file, 'r') as fp:
+    tickers = fp.read().splitlines()
+  logging.info('Processing %d tickers' % len(tickers))
+
+  first = utils.month_ordinal(args.from_yyyy_mm)
+  last = utils.month_ordinal(args.to_yyyy_mm)
+  assert first <= last
+  months = np.arange(first, last + 1)
+
+  inputs = factor_panel.Inputs(tickers, args.price_sample_dir,
+                               args.market_sample_path, args.store_dir,
+                               args.cube_dir)
+  # Factors need market samples at each month and at every horizon of
+  # factor_engine.ER_HORIZONS before it, and forward returns at the month
+  # after it.
+  needed = months[:, None] - np.array((-1, 0) + factor_engine.ER_HORIZONS)
+  has_market = ~np.isnan(
+      inputs.market.lookup(needed.ravel())[0]).reshape(needed.shape).any(axis=1)
+  if not has_market.all():
+    logging.warning('Skipping %d months without market samples: %s'
+                    % (np.count_nonzero(~has_market),
+                       ' '.join(utils.month_string(m)
+                                for m in months[~has_market])))
+  # Skipped months keep NaN payoffs, so that the trailing window still
+  # spans --window calendar months.
+  payoffs = np.full((len(months), len(factor_engine.SCORE_FACTORS)), np.nan)
+  if has_market.any():
+    panel = factor_panel.build(inputs, months[has_market])
+    x, valid = panel.stack(factor_engine.SCORE_FACTORS)
+    y, y_valid = factor_panel.forward_returns(inputs, months[has_market])
+    valid &= y_valid
+    payoffs[has_market] = regress(x, y, valid) * 100
+  logging.info('Regressed %d months, %d solvable'
+               % (len(months), (~np.isnan(payoffs).any(axis=1)).sum()))
+
+  weights, ok = trailing_average(payoffs, int(args.window))
+  write_weights(months, weights, ok, args.output_path)
+  if args.payoffs_path != '':
+    write_weights(months, payoffs, ~np.isnan(payoffs).any(axis=1),
+                  args.payoffs_path)
+
+if __name__ == '__main__':
+  main()
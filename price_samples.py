@@ -0,0 +1,110 @@
+#!/usr/local/bin/python3
+
+""" Loads monthly price samples into a dense ticker x month matrix.
+
+    A price sample file has one "date volume price" line per month.  Files
+    are named after the ticker, with '^' replaced by '_'.  If a month has
+    more than one sample, the first one is used, as haugen_current_price.py
+    does, or the last one with keep_last, as haugen_excess_return.py does.
+"""
+
+import logging
+import numpy as np
+import utils
+from os import path
+
+# Defaults of haugen_excess_return.py.
+PRICE_BONUS = 0.01
+MIN_CAP = -1.0
+MAX_CAP = 1.0
+
+def read_samples(input_path, keep_last=False):
+  samples = dict()
+  with open(input_path, 'r') as fp:
+    for line in fp.read().splitlines():
+      dt, vo, pr = line.split(' ')
+      m = utils.month_ordinal(dt)
+      if keep_last or m not in samples:
+        samples[m] = float(pr)
+  return samples
+
+class SampleMatrix:
+  """ tickers: the ticker index.
+      months: consecutive month ordinals.
+      prices: tickers x months, NaN where there is no sample.
+  """
+  def __init__(self, tickers, months, prices):
+    self.tickers = tickers
+    self.ticker_index = {t: i for i, t in enumerate(tickers)}
+    self.months = months
+    self.prices = prices
+
+  # Returns the columns of month ordinals, -1 where out of range.
+  def columns(self, months):
+    columns = np.asarray(months, dtype=np.int64) - (
+        int(self.months[0]) if len(self.months) > 0 else 0)
+    return np.where((columns >= 0) & (columns < len(self.months)), columns, -1)
+
+  # Returns tickers x months prices, NaN where there is no sample.
+  def lookup(self, months):
+    columns = self.columns(months)
+    prices = self.prices[:, np.maximum(columns, 0)]
+    return np.where(columns[None, :] >= 0, prices, np.nan)
+
+# Loads the sample files of tickers from sample_dir.
+def load(sample_dir, tickers, keep_last=False):
+  return load_paths(tickers, ['%s/%s.csv' % (sample_dir, t.replace('^', '_'))
+                              for t in tickers], keep_last)
+
+# Loads one sample file per ticker.
+def load_paths(tickers, input_paths, keep_last=False):
+  data = []
+  for input_path in input_paths:
+    if not path.isfile(input_path):
+      logging.warning('Input file is missing: %s' % input_path)
+      data.append(dict())
+      continue
+    data.append(read_samples(input_path, keep_last))
+  months = [m for samples in data for m in samples]
+  first = min(months) if months else 0
+  count = max(months) - first + 1 if months else 0
+  prices = np.full((len(tickers), count), np.nan)
+  for i, samples in enumerate(data):
+    for m, price in samples.items():
+      prices[i, m - first] = price
+  logging.info('Loaded %d tickers x %d months of price samples'
+               % (len(tickers), count))
+  return SampleMatrix(list(tickers), np.arange(first, first + count), prices)
+
+# Excess returns of stock prices over market prices, with PRICE_BONUS added
+# to the base prices and clipped to [min_cap, max_cap].
+def compute_excess(stock_from, stock_to, market_from, market_to,
+                   bonus=PRICE_BONUS, min_cap=MIN_CAP, max_cap=MAX_CAP):
+  assert bonus > 0  # bonus must be positive to prevent divide-by-zero errors.
+  for prices in (stock_from, stock_to, market_from, market_to):
+    assert not (prices < 0).any()
+  stock_r = (stock_to - stock_from) / (stock_from + bonus)
+  market_r = (market_to - market_from) / (market_from + bonus)
+  return np.clip(stock_r - market_r, min_cap, max_cap)
+
+# Computes excess returns over the market for every ticker, month and
+# horizon (in months).  market is a single-row SampleMatrix, which must have
+# samples for all the months involved.  Both are loaded with keep_last to
+# match haugen_excess_return.py.
+# Returns: {horizon: (excess, valid)}, both tickers x months.
+def excess_returns(matrix, market, months, horizons):
+  months = np.asarray(months, dtype=np.int64)
+  to_stock = matrix.lookup(months)
+  to_market = market.lookup(months)
+  assert not np.isnan(to_market).any(), 'missing market samples'
+  output = dict()
+  for k in horizons:
+    assert k > 0
+    from_stock = matrix.lookup(months - k)
+    from_market = market.lookup(months - k)
+    assert not np.isnan(from_market).any(), 'missing market samples'
+    valid = ~np.isnan(from_stock) & ~np.isnan(to_stock)
+    with np.errstate(invalid='ignore'):
+      excess = compute_excess(from_stock, to_stock, from_market, to_market)
+    output[k] = (np.where(valid, excess, np.nan), valid)
+  return output
@@ -0,0 +1,184 @@
+#!/usr/local/bin/python3
+
+""" Builds a binary store of daily prices from daily price files.
+
+    The rows of all tickers are concatenated, oldest day first, into one
+    array per column, and a ticker's rows are a slice of them.  Arrays are
+    saved as NumPy files and loaded memory-mapped, so slices are zero-copy.
+    Rebuilding is incremental: only tickers whose daily file changed since
+    the last build are re-read; the rows of the others are copied from the
+    old store.
+
+    Store layout:
+    - tickers.txt: the ticker index, one ticker per line.
+    - offsets.npy: int64, tickers + 1; ticker i spans [offsets[i],
+      offsets[i+1]).
+    - days.npy: int32 day ordinals (datetime.date.toordinal()).
+    - open.npy, high.npy, low.npy, close.npy, volume.npy, adjclose.npy:
+      float64.
+    - state.txt: "<ticker> <size> <mtime_ns>" of the daily file each ticker
+      was built from.
+"""
+
+import argparse
+import daily_prices
+import logging
+import numpy as np
+import utils
+from datetime import date
+from os import makedirs, path, remove, stat
+
+COLUMNS = ('open', 'high', 'low', 'close', 'volume', 'adjclose')
+
+# Day ordinal of 1970-01-01, the epoch of numpy datetime64.
+EPOCH = date(1970, 1, 1).toordinal()
+
+def day_ordinal(yyyy_mm_dd):
+  return date.fromisoformat(yyyy_mm_dd).toordinal()
+
+# Month ordinals (see utils.month_ordinal) of an array of day ordinals.
+def day_months(days):
+  months = (np.asarray(days, dtype=np.int64) - EPOCH).astype('datetime64[D]')
+  return months.astype('datetime64[M]').astype(np.int64) + 1970 * 12
+
+# First day ordinal of a month ordinal.
+def month_first_day(month):
+  return date(month // 12, month % 12 + 1, 1).toordinal()
+
+# Reads a daily price file into (days, {column: values}), oldest first.
+# Raises ValueError if the file is malformed.
+def read_file(input_path):
+  rows = daily_prices.read_rows(input_path)
+  rows.reverse()
+  for row in rows:
+    if len(row) != len(COLUMNS) + 1:
+      raise ValueError('bad row in %s: %s' % (input_path, ','.join(row)))
+  days = np.array([day_ordinal(row[0]) for row in rows], dtype=np.int32)
+  if not (np.diff(days) > 0).all():
+    raise ValueError('rows are not strictly newest first in %s' % input_path)
+  values = dict()
+  for j in range(len(COLUMNS)):
+    values[COLUMNS[j]] = np.array([float(row[j+1]) for row in rows])
+  return days, values
+
+def file_state(input_path):
+  st = stat(input_path)
+  return '%d %d' % (st.st_size, st.st_mtime_ns)
+
+class Store:
+  """ Read-only view of a store.  Arrays are memory-mapped.
+  """
+  def __init__(self, store_dir):
+    self.store_dir = store_dir
+    with open('%s/tickers.txt' % store_dir, 'r') as fp:
+      self.tickers = fp.read().splitlines()
+    self.ticker_index = {t: i for i, t in enumerate(self.tickers)}
+    self.offsets = np.load('%s/offsets.npy' % store_dir)
+    self.days = np.load('%s/days.npy' % store_dir, mmap_mode='r')
+    self.columns = dict()
+    for column in COLUMNS:
+      self.columns[column] = np.load('%s/%s.npy' % (store_dir, column),
+                                     mmap_mode='r')
+
+  # Returns the slice of the rows of ticker index i.
+  def rows(self, i):
+    return slice(int(self.offsets[i]), int(self.offsets[i+1]))
+
+  # Returns the slice of the rows of ticker index i within
+  # [from_day, to_day].
+  def window(self, i, from_day, to_day):
+    s = self.rows(i)
+    days = self.days[s]
+    begin = np.searchsorted(days, from_day, side='left')
+    end = np.searchsorted(days, to_day, side='right')
+    return slice(s.start + int(begin), s.start + int(end))
+
+  # Returns (days, {column: values}) views of a ticker, oldest first.
+  def series(self, ticker):
+    s = self.rows(self.ticker_index[ticker])
+    return self.days[s], {c: v[s] for c, v in self.columns.items()}
+
+def build(tickers, price_dir, store_dir):
+  old = None
+  old_state = dict()
+  if path.isfile('%s/state.txt' % store_dir):
+    old = Store(store_dir)
+    with open('%s/state.txt' % store_dir, 'r') as fp:
+      for line in fp.read().splitlines():
+        ticker, state = line.split(' ', 1)
+        old_state[ticker] = state
+
+  state = dict()
+  parts = []  # (days, {column: values}) per ticker
+  fresh, reused = 0, 0
+  for i in range(len(tickers)):
+    ticker = tickers[i]
+    input_path = '%s/%s.csv' % (price_dir, ticker.replace('^', '_'))
+    if not path.isfile(input_path):
+      logging.warning('Input file is missing: %s' % input_path)
+      parts.append(None)
+      continue
+    state[ticker] = file_state(input_path)
+    if (old is not None and old_state.get(ticker) == state[ticker]
+        and ticker in old.ticker_index):
+      s = old.rows(old.ticker_index[ticker])
+      parts.append((np.array(old.days[s]),
+                    {c: np.array(v[s]) for c, v in old.columns.items()}))
+      reused += 1
+      continue
+    logging.info('%d/%d: reading %s' % (i+1, len(tickers), ticker))
+    try:
+      parts.append(read_file(input_path))
+    except ValueError as e:
+      # Left out of the state, so the ticker is read again next time.
+      logging.warning('Skipping %s: %s' % (ticker, e))
+      del state[ticker]
+      parts.append(None)
+      continue
+    fresh += 1
+  old = None  # release the memory maps before overwriting
+  logging.info('Read %d tickers, reused %d tickers' % (fresh, reused))
+
+  offsets = [0]
+  for part in parts:
+    offsets.append(offsets[-1] + (len(part[0]) if part is not None else 0))
+  present = [part for part in parts if part is not None]
+
+  makedirs(store_dir, exist_ok=True)
+  # The state is removed first and written last, so an interrupted build is
+  # redone in full.
+  if path.isfile('%s/state.txt' % store_dir):
+    remove('%s/state.txt' % store_dir)
+  with open('%s/tickers.txt' % store_dir, 'w') as fp:
+    for ticker in tickers:
+      print(ticker, file=fp)
+  np.save('%s/offsets.npy' % store_dir, np.array(offsets, dtype=np.int64))
+  np.save('%s/days.npy' % store_dir,
+          np.concatenate([p[0] for p in present] + [np.zeros(0, np.int32)]))
+  for column in COLUMNS:
+    np.save('%s/%s.npy' % (store_dir, column),
+            np.concatenate([p[1][column] for p in present] + [np.zeros(0)]))
+  with open('%s/state.txt' % store_dir, 'w') as fp:
+    for ticker in tickers:
+      if ticker in state:
+        print('%s %s' % (ticker, state[ticker]), file=fp)
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--ticker_file', required=True)
+  parser.add_argument('--price_dir', required=True)
+  parser.add_argument('--store_dir', required=True)
+  parser.add_argument('--verbose', action='store_true')
+  args = parser.parse_args()
+
+  utils.setup_logging(args.verbose)
+
+  # Tickers are listed one per line.
+  with open(args.ticker_file, 'r') as fp:
+    tickers = fp.read().splitlines()
+  logging.info('Processing %d tickers' % len(tickers))
+
+  build(tickers, args.price_dir, args.store_dir)
+
+if __name__ == '__main__':
+  main()
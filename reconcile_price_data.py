@@ -1,28 +1,102 @@
 #!/usr/local/bin/python3
 
+""" Reconciles newly downloaded daily price files with old ones.
+
+    Both files are newest first.  The rows of the new file newer than the
+    latest date of the old file are put in front of the old file; the new
+    file is read only up to that date and the old file is copied as a
+    stream.  The output is written to a temporary file and renamed, so
+    output_dir may be old_download_dir (with --overwrite).
+
+    New rows cannot be appended in place: the files are newest first, as
+    downloaded and as read by the other scripts, so new rows go at the
+    front, and a file cannot grow at its front without rewriting it.  The
+    rewrite streams the old rows once and holds none of them in memory;
+    tickers without new rows are not rewritten (see watermarks below).
+
+    output_dir/watermarks.txt records the latest date of every reconciled
+    ticker.  A ticker whose new file has nothing newer than its watermark is
+    skipped without touching its files.  If --store_dir is set, the price
+    store is updated from output_dir; only reconciled tickers are re-read.
+"""
+
 import argparse
 import logging
+import price_store
+import traceback
 import utils
-from os import path, remove
+from concurrent.futures import ProcessPoolExecutor
+from os import path, replace
+from shutil import copyfileobj
 
+def get_date(line):
+  return line[:line.find(',')]
+
+# Reads the latest date of a price file, or None if it has no rows.
+def read_latest_date(input_path):
+  with open(input_path, 'r') as fp:
+    fp.readline()  # header
+    line = fp.readline().rstrip('\r\n')
+  return get_date(line) if line != '' else None
+
+# Returns: (number of new rows, latest date of the output).
 def reconcile(old_input_path, new_input_path, output_path):
-  with open(old_input_path, 'r') as fp:
-    old_lines = fp.read().splitlines()
-  with open(new_input_path, 'r') as fp:
-    new_lines = fp.read().splitlines()
-  assert len(old_lines) > 1
-  assert len(new_lines) > 0
-  assert old_lines[0] == new_lines[0]
-  od = old_lines[1][:old_lines[1].find(',')]
-  with open(output_path, 'w') as fp:
-    print(new_lines[0], file=fp)
-    for i in range(1, len(new_lines)):
-      nd = new_lines[i][:new_lines[i].find(',')]
-      if nd <= od:
-        break
-      print(new_lines[i], file=fp)
-    for i in range(1, len(old_lines)):
-      print(old_lines[i], file=fp)
+  tmp_path = '%s.tmp' % output_path
+  with open(old_input_path, 'r') as old_fp, \
+       open(new_input_path, 'r') as new_fp:
+    old_header = old_fp.readline().rstrip('\r\n')
+    new_header = new_fp.readline().rstrip('\r\n')
+    assert new_header != ''
+    assert old_header == new_header
+    old_first = old_fp.readline().rstrip('\r\n')
+    assert old_first != ''
+    od = get_date(old_first)
+    with open(tmp_path, 'w') as fp:
+      print(new_header, file=fp)
+      count = 0
+      latest = od
+      for line in new_fp:
+        line = line.rstrip('\r\n')
+        if line == '':
+          continue
+        nd = get_date(line)
+        if nd <= od:
+          break
+        if count == 0:
+          latest = nd
+        print(line, file=fp)
+        count += 1
+      print(old_first, file=fp)
+      copyfileobj(old_fp, fp)
+  replace(tmp_path, output_path)
+  return count, latest
+
+def reconcile_ticker(task):
+  ticker, old_input_path, new_input_path, output_path = task
+  try:
+    count, latest = reconcile(old_input_path, new_input_path, output_path)
+  except Exception as e:
+    frame = traceback.extract_tb(e.__traceback__)[-1]
+    return ticker, None, '%s(%s) at %s:%d' % (type(e).__name__, e,
+                                              path.basename(frame.filename),
+                                              frame.lineno)
+  return ticker, (count, latest), None
+
+def read_watermarks(watermark_path):
+  watermarks = dict()
+  if path.isfile(watermark_path):
+    with open(watermark_path, 'r') as fp:
+      for line in fp.read().splitlines():
+        ticker, date = line.split(' ')
+        watermarks[ticker] = date
+  return watermarks
+
+def write_watermarks(watermarks, watermark_path):
+  tmp_path = '%s.tmp' % watermark_path
+  with open(tmp_path, 'w') as fp:
+    for ticker in sorted(watermarks):
+      print('%s %s' % (ticker, watermarks[ticker]), file=fp)
+  replace(tmp_path, watermark_path)
 
 def main():
   parser = argparse.ArgumentParser()
@@ -31,19 +105,27 @@ def main():
   parser.add_argument('--new_download_dir', required=True)
   parser.add_argument('--output_dir', required=True)
   parser.add_argument('--overwrite', action='store_true')
+  parser.add_argument('--workers', default='1')
+  # If set, the price store built by price_store.py from output_dir is
+  # updated with the reconciled tickers.
+  parser.add_argument('--store_dir', default='')
   parser.add_argument('--verbose', action='store_true')
   args = parser.parse_args()
 
   utils.setup_logging(args.verbose)
+  workers = int(args.workers)
+  assert workers > 0
 
   # Tickers are listed one per line.
   with open(args.ticker_file, 'r') as fp:
     tickers = fp.read().splitlines()
   logging.info('Processing %d tickers' % len(tickers))
 
+  watermark_path = '%s/watermarks.txt' % args.output_dir
+  watermarks = read_watermarks(watermark_path)
+  tasks, untouched = [], 0
   for i in range(len(tickers)):
     ticker = tickers[i]
-    logging.info('%d/%d: %s' % (i+1, len(tickers), ticker))
     old_input_path = '%s/%s.csv' % (
         args.old_download_dir, ticker.replace('^', '_'))
     new_input_path = '%s/%s.csv' % (
@@ -55,12 +137,44 @@ def main():
       logging.warning('New file does not exist: %s' % new_input_path)
       continue
     output_path = '%s/%s.csv' % (args.output_dir, ticker.replace('^', '_'))
+    if path.isfile(output_path) and ticker in watermarks:
+      nd = read_latest_date(new_input_path)
+      if nd is None or nd <= watermarks[ticker]:
+        untouched += 1
+        continue
     if path.isfile(output_path) and not args.overwrite:
       logging.warning(
           'Output file exists and not overwritable: %s' % output_path)
       continue
-    reconcile(old_input_path, new_input_path, output_path)
+    tasks.append((ticker, old_input_path, new_input_path, output_path))
+  logging.info('Reconciling %d tickers with %d workers, %d untouched'
+               % (len(tasks), workers, untouched))
+
+  if workers > 1:
+    executor = ProcessPoolExecutor(max_workers=workers)
+    chunksize = max(1, len(tasks) // (workers * 4))
+    results = executor.map(reconcile_ticker, tasks, chunksize=chunksize)
+  else:
+    executor = None
+    results = map(reconcile_ticker, tasks)
+  failed = 0
+  for i, (ticker, result, error) in enumerate(results):
+    if error is not None:
+      logging.warning('Failed to reconcile %s: %s' % (ticker, error))
+      failed += 1
+      continue
+    count, latest = result
+    logging.info('%d/%d: %s, %d new rows' % (i+1, len(tasks), ticker, count))
+    watermarks[ticker] = latest
+  if executor is not None:
+    executor.shutdown()
+
+  write_watermarks(watermarks, watermark_path)
+  logging.info('Reconciled %d tickers, failed %d tickers'
+               % (len(tasks) - failed, failed))
+
+  if args.store_dir != '':
+    price_store.build(tickers, args.output_dir, args.store_dir)
 
 if __name__ == '__main__':
   main()
-
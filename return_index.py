@@ -0,0 +1,209 @@
+#!/usr/local/bin/python3
+
+""" Prefix-sum index of daily log returns.
+
+    For every ticker (and the ^GSPC market series), the index stores the
+    trading days and the running sum of daily log returns of adjclose, so
+    the return over any [from, to] window is the difference of two prefix
+    sums.  Locating the window is a binary search over the ticker's trading
+    days; computing the return after that is constant time.  Both can be
+    done for the whole universe at once.
+
+    The price on a day is the adjclose of the latest trading day at or before
+    it.  A window is valid if the ticker has traded on or before its start,
+    and within MAX_STALE_DAYS before its end, so delisted or stale tickers
+    are dropped instead of getting a flat return.
+
+    Index layout (all tickers concatenated, oldest day first):
+    - tickers.txt: the ticker index, one ticker per line.
+    - offsets.npy: int64, tickers + 1; ticker i spans [offsets[i],
+      offsets[i+1]).
+    - days.npy: int32 day ordinals (datetime.date.toordinal()).
+    - cumlog.npy: float64 prefix sums of daily log returns, 0 on the first
+      day of each ticker.
+
+    Build: --ticker_file --price_dir|--store_dir --index_dir
+    Query: --ticker_file --index_dir --from_date --to_date --output_path,
+           which writes excess returns over the market for the window.
+
+    Excess returns here are simple returns of daily adjclose (the expm1 of
+    the log returns) minus the market's, clipped to [MIN_CAP, MAX_CAP].
+    They are not comparable to haugen_excess_return.py output, which uses
+    monthly price samples and adds PRICE_BONUS to prices.
+"""
+
+import argparse
+import daily_prices
+import logging
+import numpy as np
+import price_samples
+import price_store
+import utils
+from os import makedirs, path
+
+MARKET_TICKER = '^GSPC'
+# Days a ticker may go without trading before the end of a window; covers
+# weekends and holidays.
+MAX_STALE_DAYS = 7
+
+# Prefix sums of daily log returns of adjclose, oldest first.
+def cumulative_log_returns(adjclose, name):
+  if (adjclose <= 0).any():
+    logging.warning('Non-positive prices in %s, treated as flat' % name)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    returns = np.log(adjclose[1:] / adjclose[:-1])
+  returns[~np.isfinite(returns)] = 0.0
+  return np.concatenate([[0.0], np.cumsum(returns)])
+
+# Returns (days, cumlog) for a daily price file, oldest first.
+def read_series(input_path):
+  rows = daily_prices.read_rows(input_path)
+  rows.reverse()
+  days = np.array([price_store.day_ordinal(row[0]) for row in rows],
+                  dtype=np.int32)
+  adjclose = np.array([float(row[6]) for row in rows])
+  return days, cumulative_log_returns(adjclose, input_path)
+
+# Returns (days, cumlog) for a ticker of a price_store.Store.
+def store_series(store, ticker):
+  days, columns = store.series(ticker)
+  return (np.array(days),
+          cumulative_log_returns(np.asarray(columns['adjclose']), ticker))
+
+# Builds the index from daily price files in price_dir, or from the price
+# store in store_dir if set.
+def build(tickers, price_dir, index_dir, store_dir=''):
+  if MARKET_TICKER not in tickers:
+    tickers = tickers + [MARKET_TICKER]
+  store = price_store.Store(store_dir) if store_dir != '' else None
+  offsets = [0]
+  days, cumlogs = [], []
+  for i in range(len(tickers)):
+    ticker = tickers[i]
+    logging.info('%d/%d: %s' % (i+1, len(tickers), ticker))
+    if store is not None:
+      if ticker not in store.ticker_index:
+        logging.warning('Ticker is missing from store: %s' % ticker)
+        offsets.append(offsets[-1])
+        continue
+      d, c = store_series(store, ticker)
+    else:
+      input_path = '%s/%s.csv' % (price_dir, ticker.replace('^', '_'))
+      if not path.isfile(input_path):
+        logging.warning('Input file is missing: %s' % input_path)
+        offsets.append(offsets[-1])
+        continue
+      d, c = read_series(input_path)
+    days.append(d)
+    cumlogs.append(c)
+    offsets.append(offsets[-1] + len(d))
+  makedirs(index_dir, exist_ok=True)
+  with open('%s/tickers.txt' % index_dir, 'w') as fp:
+    for ticker in tickers:
+      print(ticker, file=fp)
+  np.save('%s/offsets.npy' % index_dir, np.array(offsets, dtype=np.int64))
+  np.save('%s/days.npy' % index_dir,
+          np.concatenate(days) if days else np.zeros(0, dtype=np.int32))
+  np.save('%s/cumlog.npy' % index_dir,
+          np.concatenate(cumlogs) if cumlogs else np.zeros(0))
+
+class ReturnIndex:
+  def __init__(self, index_dir):
+    with open('%s/tickers.txt' % index_dir, 'r') as fp:
+      self.tickers = fp.read().splitlines()
+    self.ticker_index = {t: i for i, t in enumerate(self.tickers)}
+    self.offsets = np.load('%s/offsets.npy' % index_dir)
+    self.days = np.load('%s/days.npy' % index_dir, mmap_mode='r')
+    self.cumlog = np.load('%s/cumlog.npy' % index_dir, mmap_mode='r')
+    # Offsetting each ticker's days into its own range makes the
+    # concatenated days globally sorted, so one searchsorted serves all
+    # tickers.
+    self.stride = np.int64(np.iinfo(np.int32).max) + 1
+    counts = np.diff(self.offsets)
+    self.keys = (np.asarray(self.days, dtype=np.int64)
+                 + np.repeat(np.arange(len(self.tickers)), counts)
+                 * self.stride)
+
+  # Returns the positions of the latest trading days at or before each day
+  # for each ticker index, -1 where there is none.
+  def positions(self, rows, days):
+    rows = np.asarray(rows, dtype=np.int64)
+    found = np.searchsorted(self.keys, rows * self.stride + days,
+                            side='right') - 1
+    return np.where(found >= self.offsets[rows], found, -1)
+
+  # Log returns over [from_day, to_day] for ticker indexes rows.  Rows that
+  # did not trade on or before from_day, or within max_stale_days before
+  # to_day, are invalid.
+  # Returns: (log returns, valid).
+  def log_returns(self, rows, from_day, to_day,
+                  max_stale_days=MAX_STALE_DAYS):
+    assert from_day <= to_day
+    begin = self.positions(rows, from_day)
+    end = self.positions(rows, to_day)
+    valid = begin >= 0
+    begin = np.maximum(begin, 0)
+    end = np.maximum(end, 0)
+    valid &= self.days[end] >= to_day - max_stale_days
+    return np.where(valid, self.cumlog[end] - self.cumlog[begin], np.nan), valid
+
+  def log_return(self, ticker, from_day, to_day):
+    r, valid = self.log_returns([self.ticker_index[ticker]], from_day, to_day)
+    return float(r[0]) if valid[0] else None
+
+  # Excess simple returns over the market for ticker indexes rows, capped
+  # as in haugen_excess_return.py.
+  # Returns: (excess returns, valid).
+  def excess_returns(self, rows, from_day, to_day,
+                     min_cap=price_samples.MIN_CAP,
+                     max_cap=price_samples.MAX_CAP):
+    market, market_valid = self.log_returns(
+        [self.ticker_index[MARKET_TICKER]], from_day, to_day)
+    assert market_valid[0], 'missing market data'
+    stock, valid = self.log_returns(rows, from_day, to_day)
+    excess = np.clip(np.expm1(stock) - np.expm1(market[0]), min_cap, max_cap)
+    return np.where(valid, excess, np.nan), valid
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--ticker_file', required=True)
+  parser.add_argument('--index_dir', required=True)
+  # Builds the index from daily price files if set.
+  parser.add_argument('--price_dir', default='')
+  # Builds the index from a store built by price_store.py if set.
+  parser.add_argument('--store_dir', default='')
+  # Query window, yyyy-mm-dd.
+  parser.add_argument('--from_date', default='')
+  parser.add_argument('--to_date', default='')
+  parser.add_argument('--output_path', default='')
+  parser.add_argument('--verbose', action='store_true')
+  args = parser.parse_args()
+
+  utils.setup_logging(args.verbose)
+
+  # Tickers are listed one per line.
+  with open(args.ticker_file, 'r') as fp:
+    tickers = fp.read().splitlines()
+  logging.info('Processing %d tickers' % len(tickers))
+
+  if args.price_dir != '' or args.store_dir != '':
+    build(tickers, args.price_dir, args.index_dir, args.store_dir)
+  if args.output_path == '':
+    return
+
+  assert args.from_date != '' and args.to_date != ''
+  index = ReturnIndex(args.index_dir)
+  known = [t for t in tickers if t in index.ticker_index]
+  for t in set(tickers) - set(known):
+    logging.warning('Ticker is missing from index: %s' % t)
+  rows = [index.ticker_index[t] for t in known]
+  excess, valid = index.excess_returns(
+      rows, price_store.day_ordinal(args.from_date),
+      price_store.day_ordinal(args.to_date))
+  with open(args.output_path, 'w') as fp:
+    for j in sorted(range(len(known)), key=lambda j: known[j]):
+      if valid[j]:
+        print('%s %f' % (known[j], excess[j]), file=fp)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,162 @@
+#!/usr/local/bin/python3
+
+""" Builds monthly price samples from daily price files.
+
+    For every ticker, the last trading day of each month is sampled into
+    <output_dir>/<ticker>.csv as "date volume adjclose" lines, oldest first,
+    with '^' in file names replaced by '_' (as for the daily files).  Values
+    are copied verbatim from the daily file.
+
+    Rebuilding is incremental: output_dir/state.txt records the size and
+    mtime of the daily file each sample file was built from, and only
+    tickers whose daily file changed are resampled.  Tickers are sharded
+    over a pool of worker processes if --workers > 1.
+"""
+
+import argparse
+import logging
+import traceback
+import utils
+from concurrent.futures import ProcessPoolExecutor
+from os import makedirs, path, remove, replace, stat
+
+def file_state(input_path):
+  st = stat(input_path)
+  return '%d %d' % (st.st_size, st.st_mtime_ns)
+
+# Streams a daily price file, newest first, and keeps the first row of every
+# month, which is its last trading day.
+# Returns: list of (date, volume, adjclose), oldest first.
+def read_samples(input_path):
+  samples = []
+  last_month = None
+  with open(input_path, 'r') as fp:
+    fp.readline()  # header
+    for line in fp:
+      line = line.rstrip('\r\n')
+      if line == '':
+        continue
+      d, o, h, l, c, v, a = line.split(',')
+      month = d[:7]
+      if month == last_month:
+        continue
+      assert last_month is None or month < last_month, (
+          'rows are not newest first at %s in %s' % (d, input_path))
+      last_month = month
+      samples.append((d, v, a))
+  samples.reverse()
+  return samples
+
+def sample_file(input_path, output_path):
+  samples = read_samples(input_path)
+  # Written to a temporary file and renamed, so readers never see a
+  # partial file.
+  tmp_path = '%s.tmp' % output_path
+  with open(tmp_path, 'w') as fp:
+    for sample in samples:
+      print(' '.join(sample), file=fp)
+  replace(tmp_path, output_path)
+  return len(samples)
+
+def sample_ticker(task):
+  ticker, input_path, output_path = task
+  try:
+    count = sample_file(input_path, output_path)
+  except Exception as e:
+    frame = traceback.extract_tb(e.__traceback__)[-1]
+    return ticker, None, '%s(%s) at %s:%d' % (type(e).__name__, e,
+                                              path.basename(frame.filename),
+                                              frame.lineno)
+  return ticker, count, None
+
+def read_state(state_path):
+  state = dict()
+  if path.isfile(state_path):
+    with open(state_path, 'r') as fp:
+      for line in fp.read().splitlines():
+        ticker, st = line.split(' ', 1)
+        state[ticker] = st
+  return state
+
+# Samples the daily files of tickers from price_dir into output_dir.
+# Returns: (sampled, reused, failed) lists of tickers.
+def sample_tickers(tickers, price_dir, output_dir, workers=1):
+  assert workers > 0
+  makedirs(output_dir, exist_ok=True)
+  state_path = '%s/state.txt' % output_dir
+  old_state = read_state(state_path)
+
+  state = dict()
+  reused, tasks = [], []
+  tickers = set(tickers)
+  for ticker in sorted(tickers):
+    name = ticker.replace('^', '_')
+    input_path = '%s/%s.csv' % (price_dir, name)
+    output_path = '%s/%s.csv' % (output_dir, name)
+    if not path.isfile(input_path):
+      logging.warning('Input file is missing: %s' % input_path)
+      continue
+    state[ticker] = file_state(input_path)
+    if old_state.get(ticker) == state[ticker] and path.isfile(output_path):
+      reused.append(ticker)
+      continue
+    tasks.append((ticker, input_path, output_path))
+  logging.info('Sampling %d tickers with %d workers, reusing %d tickers'
+               % (len(tasks), workers, len(reused)))
+
+  # The state is removed first and written last, so an interrupted build is
+  # redone in full.
+  if path.isfile(state_path):
+    remove(state_path)
+
+  sampled, failed = [], []
+  if workers > 1:
+    executor = ProcessPoolExecutor(max_workers=workers)
+    chunksize = max(1, len(tasks) // (workers * 4))
+    results = executor.map(sample_ticker, tasks, chunksize=chunksize)
+  else:
+    executor = None
+    results = map(sample_ticker, tasks)
+  for i, (ticker, count, error) in enumerate(results):
+    if error is None:
+      logging.info('%d/%d: %s, %d samples' % (i+1, len(tasks), ticker, count))
+      sampled.append(ticker)
+    else:
+      logging.warning('Failed to sample %s: %s' % (ticker, error))
+      failed.append(ticker)
+      del state[ticker]
+  if executor is not None:
+    executor.shutdown()
+
+  # Tickers outside this run keep their state.
+  for ticker, st in old_state.items():
+    if ticker not in state and ticker not in tickers:
+      state[ticker] = st
+  with open(state_path, 'w') as fp:
+    for ticker in sorted(state):
+      print('%s %s' % (ticker, state[ticker]), file=fp)
+  logging.info('Sampled %d tickers, reused %d tickers, failed %d tickers'
+               % (len(sampled), len(reused), len(failed)))
+  return sampled, reused, failed
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--ticker_file', required=True)
+  parser.add_argument('--price_dir', required=True)
+  parser.add_argument('--output_dir', required=True)
+  parser.add_argument('--workers', default='1')
+  parser.add_argument('--verbose', action='store_true')
+  args = parser.parse_args()
+
+  utils.setup_logging(args.verbose)
+
+  # Tickers are listed one per line.
+  with open(args.ticker_file, 'r') as fp:
+    tickers = fp.read().splitlines()
+  logging.info('Processing %d tickers' % len(tickers))
+
+  sample_tickers(tickers, args.price_dir, args.output_dir,
+                 int(args.workers))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,193 @@
+#!/usr/local/bin/python3
+
+""" Runs a graph of stages concurrently, with content-hash caching.
+
+    A stage is a module-level function called with keyword arguments: its
+    params, plus the results of the stages it depends on, keyed by their
+    names.  Independent stages run concurrently in worker processes.
+
+    Each stage has a key: the hash of its name, function, params, the
+    content of its input files and directories, and the keys of the stages
+    it depends on.  Results are pickled to <cache_dir>/<name>.<key>.pickle,
+    and a stage whose key has a cached result is not run.  So a rerun only
+    runs the stages whose inputs changed, and the stages downstream of them.
+    Stage code is not part of the key: clear the cache after changing it.
+
+    Hashing file contents is memoized in <cache_dir>/hashes.txt by file size
+    and mtime, so unchanged files are not re-read.
+"""
+
+import hashlib
+import logging
+import pickle
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from os import listdir, makedirs, path, remove, replace, stat
+
+class Stage:
+  """ A node of the graph.
+
+      inputs are the files and directories the stage reads, deps the names
+      of the stages whose results it takes.
+  """
+  def __init__(self, name, fn, params=None, inputs=(), deps=()):
+    self.name = name
+    self.fn = fn
+    self.params = params or dict()
+    self.inputs = list(inputs)
+    self.deps = list(deps)
+
+class FileHasher:
+  """ Content hashes of files and directories, memoized by size and mtime.
+  """
+  def __init__(self, memo_path):
+    self.memo_path = memo_path
+    self.memo = dict()  # path -> (size mtime_ns, sha1)
+    if path.isfile(memo_path):
+      with open(memo_path, 'r') as fp:
+        for line in fp.read().splitlines():
+          sha1, size, mtime, file_path = line.split(' ', 3)
+          self.memo[file_path] = ('%s %s' % (size, mtime), sha1)
+
+  def file_hash(self, file_path):
+    st = stat(file_path)
+    state = '%d %d' % (st.st_size, st.st_mtime_ns)
+    if file_path in self.memo and self.memo[file_path][0] == state:
+      return self.memo[file_path][1]
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as fp:
+      for block in iter(lambda: fp.read(1 << 20), b''):
+        h.update(block)
+    self.memo[file_path] = (state, h.hexdigest())
+    return h.hexdigest()
+
+  # Hashes a file, or the names and contents of the files of a directory.
+  # A missing path hashes to a fixed value.
+  def hash(self, input_path):
+    h = hashlib.sha1(input_path.encode('utf-8'))
+    if path.isdir(input_path):
+      for name in sorted(listdir(input_path)):
+        file_path = '%s/%s' % (input_path, name)
+        if path.isfile(file_path):
+          h.update(('%s %s\n' % (name, self.file_hash(file_path)))
+                   .encode('utf-8'))
+    elif path.isfile(input_path):
+      h.update(self.file_hash(input_path).encode('utf-8'))
+    else:
+      h.update(b'missing')
+    return h.hexdigest()
+
+  def save(self):
+    tmp_path = '%s.tmp' % self.memo_path
+    with open(tmp_path, 'w') as fp:
+      for file_path in sorted(self.memo):
+        state, sha1 = self.memo[file_path]
+        print('%s %s %s' % (sha1, state, file_path), file=fp)
+    replace(tmp_path, self.memo_path)
+
+# Returns the stages in an order where every stage comes after its deps.
+def topological_order(stages):
+  by_name = {s.name: s for s in stages}
+  assert len(by_name) == len(stages), 'duplicate stage names'
+  order, state = [], dict()  # state: 1 = visiting, 2 = done
+  def visit(name):
+    assert name in by_name, 'unknown stage: %s' % name
+    assert state.get(name) != 1, 'cycle at stage %s' % name
+    if state.get(name) == 2:
+      return
+    state[name] = 1
+    for dep in by_name[name].deps:
+      visit(dep)
+    state[name] = 2
+    order.append(by_name[name])
+  for s in stages:
+    visit(s.name)
+  return order
+
+def stage_key(stage, hasher, dep_keys):
+  h = hashlib.sha1()
+  h.update(('%s %s.%s\n' % (stage.name, stage.fn.__module__,
+                            stage.fn.__qualname__)).encode('utf-8'))
+  h.update(repr(sorted(stage.params.items())).encode('utf-8'))
+  for input_path in stage.inputs:
+    h.update(hasher.hash(input_path).encode('utf-8'))
+  for dep in stage.deps:
+    h.update(dep_keys[dep].encode('utf-8'))
+  return h.hexdigest()
+
+def run_stage(fn, kwargs):
+  return fn(**kwargs)
+
+def read_result(cache_path):
+  with open(cache_path, 'rb') as fp:
+    return pickle.load(fp)
+
+def write_result(cache_dir, name, key, result):
+  # Older results of the stage are stale.
+  for f in listdir(cache_dir):
+    if f.startswith('%s.' % name) and f.endswith('.pickle'):
+      remove('%s/%s' % (cache_dir, f))
+  cache_path = '%s/%s.%s.pickle' % (cache_dir, name, key)
+  with open('%s.tmp' % cache_path, 'wb') as fp:
+    pickle.dump(result, fp, protocol=pickle.HIGHEST_PROTOCOL)
+  replace('%s.tmp' % cache_path, cache_path)
+
+# Runs stages over a pool of worker processes, or serially in this process
+# if workers is 1.  Results are cached in cache_dir unless it is empty.
+# Returns: {stage name: result} of all stages.
+def run(stages, workers=1, cache_dir=''):
+  assert workers > 0
+  order = topological_order(stages)
+  hasher = None
+  keys = dict()
+  if cache_dir != '':
+    makedirs(cache_dir, exist_ok=True)
+    hasher = FileHasher('%s/hashes.txt' % cache_dir)
+    for s in order:
+      keys[s.name] = stage_key(s, hasher, keys)
+    hasher.save()
+
+  results = dict()
+  cached = dict()
+  for s in order:
+    if cache_dir == '':
+      continue
+    cache_path = '%s/%s.%s.pickle' % (cache_dir, s.name, keys[s.name])
+    if path.isfile(cache_path):
+      cached[s.name] = cache_path
+  logging.info('Running %d stages, %d cached'
+               % (len(order) - len(cached), len(cached)))
+  for name, cache_path in cached.items():
+    results[name] = read_result(cache_path)
+
+  executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+  pending = [s for s in order if s.name not in results]
+  running = dict()  # future -> stage
+  try:
+    while pending or running:
+      ready = [s for s in pending if all(d in results for d in s.deps)]
+      for s in ready:
+        pending.remove(s)
+        kwargs = dict(s.params)
+        for dep in s.deps:
+          kwargs[dep] = results[dep]
+        logging.info('Started stage %s' % s.name)
+        if executor is None:
+          results[s.name] = run_stage(s.fn, kwargs)
+          logging.info('Finished stage %s' % s.name)
+          if cache_dir != '':
+            write_result(cache_dir, s.name, keys[s.name], results[s.name])
+        else:
+          running[executor.submit(run_stage, s.fn, kwargs)] = s
+      if executor is None or not running:
+        continue
+      done, _ = wait(running, return_when=FIRST_COMPLETED)
+      for future in done:
+        s = running.pop(future)
+        results[s.name] = future.result()
+        logging.info('Finished stage %s' % s.name)
+        if cache_dir != '':
+          write_result(cache_dir, s.name, keys[s.name], results[s.name])
+  finally:
+    if executor is not None:
+      executor.shutdown(cancel_futures=True)
+  return results
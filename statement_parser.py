@@ -0,0 +1,261 @@
+#!/usr/local/bin/python3
+
+""" Parses downloaded financial reports (income statements, balance sheets and
+    cash flow statements).
+
+    A report is tokenized exactly once into a Report, which then serves both
+    validation and metric extraction.  Metric extraction is driven by a
+    declarative schema per report type.  parse_tickers() parses a ticker
+    list, optionally sharded over a process pool.
+"""
+
+import logging
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from csv import reader
+from os import path
+
+REVENUE_KEYS = (
+    '|Revenue',
+    '|Total net revenue',
+    '|Total revenues',
+    '|Total interest and dividend income',
+)
+
+EQUITY_KEYS = (
+    "|Total stockholders' equity",
+    "|Total Stockholders' equity",
+)
+
+LIABILITIES_KEYS = (
+    '|Total liabilities',
+    'Non-current liabilities|Total liabilities',
+)
+
+def distance(ym1, ym2):
+  y1, m1 = ym1.split('-')
+  y2, m2 = ym2.split('-')
+  y1, m1 = int(y1), int(m1)
+  y2, m2 = int(y2), int(m2)
+  return (y1 - y2) * 12 + m1 - m2
+
+class Report:
+  """ A tokenized report.
+
+      dates: the report dates, excluding TTM.
+      rows: mapping from <header>|<name> keys to values (strings, possibly
+            empty), excluding TTM.
+      is_quarterly: whether the dates are 3 months apart.
+  """
+  def __init__(self, dates, rows, is_quarterly):
+    self.dates = dates
+    self.rows = rows
+    self.is_quarterly = is_quarterly
+
+def tokenize(lines):
+  # This is necessary for csv reader to work properly.
+  lines = [line.replace('\ufeff', '') for line in lines]
+  ttm = 0
+  header = ''
+  rows = dict()
+  dates = None
+  is_quarterly = True
+  for items in reader(lines, delimiter=','):
+    assert len(items) > 0
+    if len(items) == 1:
+      header = items[0]
+      continue
+    if items[0].startswith('Fiscal year ends in '):
+      if items[-1] == 'TTM':
+        ttm = 1
+        for j in range(1, len(items)-ttm-1):
+          if distance(items[j+1], items[j]) != 3:
+            is_quarterly = False
+      dates = items[1:len(items)-ttm]
+    assert len(items) == 6 + ttm, items
+    key = '%s|%s' % (header, items[0])
+    rows[key] = items[1:len(items)-ttm]
+    header = ''
+  return Report(dates, rows, is_quarterly)
+
+def read_report(input_path):
+  with open(input_path, 'r') as fp:
+    return tokenize(fp.read().splitlines())
+
+# Derived metrics.  Each takes the rows of a report and returns the values.
+
+def derive_revenue(rows):
+  assert '|Total interest income' in rows
+  assert '|Total interest expense' in rows
+  assert '|Total noninterest revenue' in rows
+  iincome = rows['|Total interest income']
+  iexp = rows['|Total interest expense']
+  nincome = rows['|Total noninterest revenue']
+  assert len(iincome) == len(nincome) and len(iincome) == len(iexp)
+  revenue = []
+  for j in range(len(iincome)):
+    i, e, n = 0.0, 0.0, 0.0
+    if iincome[j] != '': i = float(iincome[j])
+    if iexp[j] != '': e = float(iexp[j])
+    if nincome[j] != '': n = float(nincome[j])
+    revenue.append(i-e+n)
+  return [str(r) for r in revenue]
+
+def derive_total_liabilities(rows):
+  assert "|Total stockholders' equity" in rows
+  assert "|Total liabilities and stockholders' equity" in rows
+  equity = rows["|Total stockholders' equity"]
+  liabilities_and_equity = rows["|Total liabilities and stockholders' equity"]
+  assert equity == liabilities_and_equity
+  assert len(equity) == 5
+  return ['0', '0', '0', '0', '0']
+
+# Each schema lists the output metrics of a report type, in output order, as
+# (name, keys, derive, required).  The first key present in the report gives
+# the metric; otherwise derive(rows) computes it, if derive is not None.  A
+# missing required metric fails parsing, and a missing optional metric is
+# left out of the output.
+IS_SCHEMA = (
+    ('revenue', REVENUE_KEYS, derive_revenue, True),
+    ('outstanding_shares', ('Weighted average shares outstanding|Basic',),
+     None, True),
+    ('net_income', ('|Net income',), None, True),
+    ('net_income_common', ('|Net income available to common shareholders',),
+     None, True),
+    ('eps', ('Earnings per share|Basic',), None, True),
+    ('preferred_dividend', ('|Preferred dividend',), None, False),
+)
+
+BS_SCHEMA = (
+    ('total_assets', ('|Total assets',), None, True),
+    ('total_liabilities', LIABILITIES_KEYS, derive_total_liabilities, True),
+    ('total_equity', EQUITY_KEYS, None, True),
+    ('intangible_assets', ('|Intangible assets',), None, False),
+)
+
+CF_SCHEMA = (
+    ('operating_cashflow', ('|Net cash provided by operating activities',),
+     None, True),
+)
+
+SCHEMAS = {
+    'is': IS_SCHEMA,
+    'bs': BS_SCHEMA,
+    'cf': CF_SCHEMA,
+}
+
+# Returns the output lines for a report: a date line followed by one line per
+# metric.
+def extract(report, schema):
+  assert report.dates is not None
+  output = [','.join(['date'] + report.dates)]
+  for name, keys, derive, required in schema:
+    values = None
+    for key in keys:
+      if key in report.rows:
+        values = report.rows[key]
+        break
+    if values is None and derive is not None:
+      values = derive(report.rows)
+    if values is None:
+      assert not required, 'Missing metric: %s' % name
+      continue
+    output.append(','.join([name] + values))
+  return output
+
+def parse_lines(report_type, lines):
+  return extract(tokenize(lines), SCHEMAS[report_type])
+
+# Validates a report against the metric maps described in
+# validate_financial_data.py.
+# Returns: (keys, has_opt, is_quarterly).
+def validate(report, ticker, req_map, opt_map, add_map, skip_map):
+  keys = set(report.rows.keys())
+  metrics = set()
+  for key in keys:
+    if key in req_map:
+      metrics.add(req_map[key])
+    if key in opt_map:
+      metrics.add(opt_map[key])
+  diff = set(req_map.values()) - metrics
+  final_diff = set()
+  for d in diff:
+    if d in skip_map and ticker in skip_map[d]:
+      continue
+    if d not in add_map:
+      final_diff.add(d)
+    elif not any(set(c) <= keys for c in add_map[d]):
+      final_diff.add(d)
+  assert len(final_diff) == 0, 'Non-empty diff: %s' % final_diff
+  return keys, len((metrics & set(opt_map.values()))) > 0, report.is_quarterly
+
+def parse_file(report_type, input_path, output_path):
+  output = extract(read_report(input_path), SCHEMAS[report_type])
+  with open(output_path, 'w') as fp:
+    for line in output:
+      print(line, file=fp)
+
+# Parses one ticker in a worker.  Errors are captured and returned so that
+# one bad report does not abort the whole run.
+# Returns: (ticker, error), where error is None on success.
+def parse_ticker(task):
+  report_type, ticker, input_path, output_path = task
+  try:
+    parse_file(report_type, input_path, output_path)
+  except Exception as e:
+    # Bare asserts carry no message, so report where the error was raised.
+    frame = traceback.extract_tb(e.__traceback__)[-1]
+    return ticker, '%s(%s) at %s:%d' % (type(e).__name__, e,
+                                         path.basename(frame.filename),
+                                         frame.lineno)
+  return ticker, None
+
+# Parses the reports of tickers from input_dir into output_dir, sharding the
+# tickers over a pool of worker processes if workers > 1.  Results are
+# processed in ticker order, so the output does not depend on scheduling.
+# Returns: (parsed, skipped, failed) lists of tickers.
+def parse_tickers(report_type, tickers, input_dir, output_dir, overwrite,
+                  workers=1, skipped_tickers=()):
+  assert workers > 0
+  skipped, tasks = [], []
+  for ticker in tickers:
+    input_path = '%s/%s.csv' % (input_dir, ticker)
+    output_path = '%s/%s.csv' % (output_dir, ticker)
+    if ticker in skipped_tickers:
+      logging.warning('Skipped %s' % ticker)
+      skipped.append(ticker)
+      continue
+    if not path.isfile(input_path):
+      logging.warning('Input file does not exist: %s' % input_path)
+      skipped.append(ticker)
+      continue
+    if path.isfile(output_path) and not overwrite:
+      logging.warning('Output file exists and not overwritable: %s'
+          % output_path)
+      skipped.append(ticker)
+      continue
+    tasks.append((report_type, ticker, input_path, output_path))
+  logging.info('Parsing %d tickers with %d workers' % (len(tasks), workers))
+
+  parsed, failed = [], []
+  if workers > 1:
+    executor = ProcessPoolExecutor(max_workers=workers)
+    chunksize = max(1, len(tasks) // (workers * 4))
+    results = executor.map(parse_ticker, tasks, chunksize=chunksize)
+  else:
+    executor = None
+    results = map(parse_ticker, tasks)
+  for i, (ticker, error) in enumerate(results):
+    logging.info('%d/%d: %s' % (i+1, len(tasks), ticker))
+    if error is None:
+      parsed.append(ticker)
+    else:
+      logging.warning('Failed to parse %s: %s' % (ticker, error))
+      failed.append(ticker)
+  if executor is not None:
+    executor.shutdown()
+
+  logging.info('Parsed %d tickers, skipped %d tickers, failed %d tickers'
+               % (len(parsed), len(skipped), len(failed)))
+  logging.info('Failed tickers: %s' % failed)
+  return parsed, skipped, failed
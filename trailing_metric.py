@@ -0,0 +1,109 @@
+#!/usr/local/bin/python3
+
+""" Computes trailing k-quarter aggregates of a metric for every ticker and
+    every month in a range, from a fundamentals store (see
+    fundamentals_store.py).
+
+    This is the whole-array counterpart of haugen_metric.py, with the same
+    rules: for each ticker and month, take the most recent reported quarter
+    at or before the month, require k reported quarters up to it that are 3
+    months apart, reject the window if the most recent quarter is more than
+    6 months old, and sum the metric over the window, treating empty values
+    as 0 unless skip_empty is set, in which case the window is rejected.
+
+    Outputs a tickers x months panel as a NumPy file (NaN where there is no
+    valid window) and/or haugen_metric.py-style map files, one per month.
+"""
+
+import argparse
+import asof_index
+import fundamentals_store
+import logging
+import numpy as np
+import utils
+
+MAX_STALENESS = 6  # months
+
+# Returns: (sums, valid), both tickers x months.
+def trailing_sums(values, present, reported, quarters, months, k,
+                  skip_empty):
+  assert k > 0
+  index = asof_index.AsOfIndex.from_reported(reported, quarters)
+  columns, ordinals, counts = index.columns, index.ordinals, index.counts
+  n, width = columns.shape
+  packed = np.take_along_axis(np.asarray(values), columns, axis=1)
+  in_range = np.arange(width)[None, :] < counts[:, None]
+  empty = np.isnan(packed) & in_range
+  zero = np.zeros((n, 1))
+  csum = np.concatenate([zero, np.cumsum(np.where(empty | ~in_range, 0.0,
+                                                  packed), axis=1)], axis=1)
+  cempty = np.concatenate([zero, np.cumsum(empty, axis=1)], axis=1)
+
+  months = np.asarray(months, dtype=np.int64)
+  latest = index.latest_batch(months)
+  at = np.maximum(latest, 0)
+  valid = latest >= k - 1
+  valid &= months[None, :] - np.take_along_axis(ordinals, at, axis=1) <= (
+      MAX_STALENESS)
+  valid &= np.take_along_axis(index.runs, at, axis=1) >= k
+  valid &= np.asarray(present)[:, None]
+  end = at + 1
+  begin = np.maximum(end - k, 0)
+  sums = (np.take_along_axis(csum, end, axis=1)
+          - np.take_along_axis(csum, begin, axis=1))
+  if skip_empty:
+    empties = (np.take_along_axis(cempty, end, axis=1)
+               - np.take_along_axis(cempty, begin, axis=1))
+    valid &= empties == 0
+  return np.where(valid, sums, np.nan), valid
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--store_dir', required=True)
+  parser.add_argument('--metric', required=True)
+  # Aggregate the last k quarters' data.
+  parser.add_argument('--k', default='1')
+  parser.add_argument('--skip_empty', action='store_true')
+  # Inclusive range of months.
+  parser.add_argument('--from_yyyy_mm', required=True)
+  parser.add_argument('--to_yyyy_mm', required=True)
+  # tickers x months NumPy panel.
+  parser.add_argument('--panel_path', default='')
+  # Map files; must contain {yyyy_mm}, which is replaced by the month.
+  parser.add_argument('--output_path', default='')
+  parser.add_argument('--verbose', action='store_true')
+  args = parser.parse_args()
+
+  utils.setup_logging(args.verbose)
+
+  assert args.panel_path != '' or args.output_path != '', (
+      'at least one of --panel_path and --output_path is required')
+  assert args.output_path == '' or args.output_path.find('{yyyy_mm}') >= 0
+  store = fundamentals_store.Store(args.store_dir)
+  first = utils.month_ordinal(args.from_yyyy_mm)
+  last = utils.month_ordinal(args.to_yyyy_mm)
+  assert first <= last
+  months = np.arange(first, last + 1)
+  logging.info('Aggregating %s for %d tickers and %d months'
+               % (args.metric, len(store.tickers), len(months)))
+
+  sums, valid = trailing_sums(
+      store.values(args.metric), store.present(args.metric),
+      store.reported(args.metric), store.quarters, months, int(args.k),
+      args.skip_empty)
+  logging.info('%d of %d values are valid' % (valid.sum(), valid.size))
+
+  if args.panel_path != '':
+    np.save(args.panel_path, sums)
+  if args.output_path != '':
+    order = sorted(range(len(store.tickers)), key=lambda i: store.tickers[i])
+    for m in range(len(months)):
+      output_path = args.output_path.replace(
+          '{yyyy_mm}', utils.month_string(months[m]))
+      with open(output_path, 'w') as fp:
+        for i in order:
+          if valid[i, m]:
+            print('%s %f' % (store.tickers[i], sums[i, m]), file=fp)
+
+if __name__ == '__main__':
+  main()
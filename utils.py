@@ -25,3 +25,19 @@ def read_map(filename):
     m[k] = float(v)
   return m
 
+# Inverse of read_map.
+def write_map(m, filename, value_format='%f'):
+  with open(filename, 'w') as fp:
+    for k in sorted(m.keys()):
+      print(('%s ' + value_format) % (k, m[k]), file=fp)
+
+
+# Converts a yyyy-mm (or yyyy-mm-dd) string to a month ordinal, so that the
+# distance in months between two dates is the difference of their ordinals.
+def month_ordinal(date):
+  y, m = date[:7].split('-')
+  return int(y) * 12 + int(m) - 1
+
+# Inverse of month_ordinal.
+def month_string(ordinal):
+  return '%04d-%02d' % (ordinal // 12, ordinal % 12 + 1)
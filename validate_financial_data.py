@@ -5,8 +5,8 @@
 
 import argparse
 import logging
+import statement_parser
 import utils
-from csv import reader
 from os import path
 
 # Tickers here are skipped for validation.
@@ -28,11 +28,12 @@ SKIPPED_TICKERS = {
 #   metric.
 #
 # During validation, each csv file must fulfill all the metrics in the req_map,
-# unless certain metrics are in the skip_map.  A first pass through the file
-# will identify all the metrics computatable from a single line, and a second
-# pass will be carried out, which examines multiple lines against add_map, if
-# certain metrics are still missing.  The opt_map is for informational purposes
-# (ie, it's nice to know how many tickers have optional metrics).
+# unless certain metrics are in the skip_map.  The file is tokenized once (see
+# statement_parser.py); the metrics computatable from a single line are
+# identified first, and the keys of all lines are then examined against
+# add_map, if certain metrics are still missing.  The opt_map is for
+# informational purposes (ie, it's nice to know how many tickers have optional
+# metrics).
 #
 # Each key consists of <header>|<name>.  In many cases the header is empty
 # string.
@@ -133,85 +134,17 @@ TYPE_MAP = {
     'cf': (CF_REQ, CF_OPT, CF_ADD, CF_SKIP),
 }
 
-def distance(ym1, ym2):
-  y1, m1 = ym1.split('-')
-  y2, m2 = ym2.split('-')
-  y1, m1 = int(y1), int(m1)
-  y2, m2 = int(y2), int(m2)
-  return (y1 - y2) * 12 + m1 - m2
-
-def find_additional(lines, combinations):
-  header = ''
-  keys = set()
-  for items in reader(lines, delimiter=','):
-    assert len(items) > 0
-    if len(items) == 1:
-      header = items[0]
-      continue
-    keys.add('%s|%s' % (header, items[0]))
-    header = ''
-  #logging.debug(keys)
-  for c in combinations:
-    #logging.debug(set(c))
-    if set(c) <= keys:
-      return True
-  return False
+# Validates the lines of a downloaded report.
+# Returns: (keys, has_opt, is_quarterly).
+def validate_lines(lines, ticker, req_map, opt_map, add_map, skip_map):
+  return statement_parser.validate(statement_parser.tokenize(lines), ticker,
+                                   req_map, opt_map, add_map, skip_map)
 
 # Returns: (keys, has_opt, is_quarterly).
 def validate(input_path, ticker, req_map, opt_map, add_map, skip_map):
   with open(input_path, 'r') as fp:
     lines = fp.read().splitlines()
-  # This is necessary for csv reader to work properly.
-  for i in range(len(lines)):
-    lines[i] = lines[i].replace('\ufeff"', '"')
-  ttm = 0
-  header = ''
-  keys = set()
-  metrics = set()
-  is_quarterly = True
-  for items in reader(lines, delimiter=','):
-    assert len(items) > 0
-    if len(items) == 1:
-      header = items[0]
-      continue
-    if (items[0].startswith('Fiscal year ends in ')
-        and items[-1] == 'TTM'):
-      ttm = 1
-      for j in range(1, len(items)-ttm-1):
-        #assert distance(items[j+1], items[j]) == 3
-        if distance(items[j+1], items[j]) != 3:
-          is_quarterly = False
-    assert len(items) == 6 + ttm, items
-
-    key = '%s|%s' % (header, items[0])
-    keys.add(key)
-    hit = False
-    if key in req_map:
-      metrics.add(req_map[key])
-      hit = True
-    if key in opt_map:
-      metrics.add(opt_map[key])
-      hit = True
-    if hit:
-      for j in range(1, len(items)):
-        try:
-          v = float(items[j])
-        except ValueError:
-          # There are cases of missing values.
-          #assert False, items
-          pass
-    header = ''
-  diff = set(req_map.values()) - metrics
-  final_diff = set()
-  for d in diff:
-    if d in skip_map and ticker in skip_map[d]:
-      continue
-    if d not in add_map:
-      final_diff.add(d)
-    elif not find_additional(lines, add_map[d]):
-      final_diff.add(d)
-  assert len(final_diff) == 0, 'Non-empty diff: %s' % final_diff
-  return keys, len((metrics & set(opt_map.values()))) > 0, is_quarterly
+  return validate_lines(lines, ticker, req_map, opt_map, add_map, skip_map)
 
 def main():
   parser = argparse.ArgumentParser()
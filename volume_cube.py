@@ -0,0 +1,184 @@
+#!/usr/local/bin/python3
+
+""" Builds a ticker x month cube of trading data from daily price files.
+
+    For every ticker and calendar month the cube holds the dollar volume
+    (sum of daily volume * adjclose), the number of trading days and the
+    month-end adjclose.  Arrays are saved as NumPy files and loaded
+    memory-mapped.  Rebuilding is incremental: only tickers whose daily file
+    changed since the last build are re-read.
+
+    Cube layout:
+    - tickers.txt: the ticker index, one ticker per line.
+    - months.npy: month ordinals (see utils.month_ordinal), consecutive.
+    - dollar_volume.npy: float64 tickers x months, 0 if no trading days.
+    - trading_days.npy: int32 tickers x months.
+    - adjclose.npy: float64 tickers x months, NaN if no trading days.
+    - state.txt: "<ticker> <size> <mtime_ns>" of the daily file each ticker
+      was built from.
+"""
+
+import argparse
+import logging
+import numpy as np
+import utils
+from os import makedirs, path, remove, stat
+
+# Aggregates a daily price file by month.
+# Returns: {month ordinal: (dollar volume, trading days, month-end adjclose)}.
+def read_months(input_path):
+  months = dict()
+  with open(input_path, 'r') as fp:
+    fp.readline()  # header
+    for line in fp:
+      line = line.rstrip('\r\n')
+      if line == '':
+        continue
+      d, o, h, l, c, v, a = line.split(',')
+      m = utils.month_ordinal(d)
+      a = float(a)
+      # Rows are newest first, so the first row of a month is its month-end.
+      if m in months:
+        dv, days, close = months[m]
+        months[m] = (dv + float(v) * a, days + 1, close)
+      else:
+        months[m] = (float(v) * a, 1, a)
+  return months
+
+def file_state(input_path):
+  st = stat(input_path)
+  return '%d %d' % (st.st_size, st.st_mtime_ns)
+
+class Cube:
+  """ Read-only view of a cube.  Arrays are memory-mapped.
+  """
+  def __init__(self, cube_dir):
+    self.cube_dir = cube_dir
+    with open('%s/tickers.txt' % cube_dir, 'r') as fp:
+      self.tickers = fp.read().splitlines()
+    self.ticker_index = {t: i for i, t in enumerate(self.tickers)}
+    self.months = np.load('%s/months.npy' % cube_dir)
+    self.dollar_volume = np.load('%s/dollar_volume.npy' % cube_dir,
+                                 mmap_mode='r')
+    self.trading_days = np.load('%s/trading_days.npy' % cube_dir,
+                                mmap_mode='r')
+    self.adjclose = np.load('%s/adjclose.npy' % cube_dir, mmap_mode='r')
+
+  # Returns the column of a month ordinal, or -1 if it is out of range.
+  def column(self, month):
+    if len(self.months) == 0:
+      return -1
+    j = month - int(self.months[0])
+    return j if 0 <= j < len(self.months) else -1
+
+  # Average monthly dollar volume over the k months ending at each of the
+  # given months, as in haugen_trading_volume.py: every month of the window
+  # must have trading days.
+  # Returns: (volumes, valid), both tickers x months.
+  def trailing_volume(self, months, k):
+    assert k > 0
+    n = len(self.tickers)
+    months = np.asarray(months, dtype=np.int64)
+    first = int(self.months[0]) if len(self.months) > 0 else 0
+    sums = np.zeros((n, len(months)))
+    valid = np.ones((n, len(months)), dtype=bool)
+    # Newest month first, the same summation order as the per-ticker script.
+    for offset in range(k):
+      columns = months - offset - first
+      in_range = (columns >= 0) & (columns < len(self.months))
+      columns = np.where(in_range, columns, 0)
+      sums += np.where(in_range[None, :], self.dollar_volume[:, columns], 0.0)
+      valid &= in_range[None, :] & (self.trading_days[:, columns] > 0)
+    return np.where(valid, sums / k, np.nan), valid
+
+def build(tickers, price_dir, cube_dir):
+  old = None
+  old_state = dict()
+  if path.isfile('%s/state.txt' % cube_dir):
+    old = Cube(cube_dir)
+    with open('%s/state.txt' % cube_dir, 'r') as fp:
+      for line in fp.read().splitlines():
+        ticker, state = line.split(' ', 1)
+        old_state[ticker] = state
+
+  state = dict()
+  fresh = dict()  # ticker index -> read_months() output
+  reused = []  # (ticker index, old ticker index)
+  for i in range(len(tickers)):
+    ticker = tickers[i]
+    input_path = '%s/%s.csv' % (price_dir, ticker.replace('^', '_'))
+    if not path.isfile(input_path):
+      logging.warning('Input file is missing: %s' % input_path)
+      continue
+    state[ticker] = file_state(input_path)
+    if (old is not None and old_state.get(ticker) == state[ticker]
+        and ticker in old.ticker_index):
+      reused.append((i, old.ticker_index[ticker]))
+      continue
+    logging.info('%d/%d: reading %s' % (i+1, len(tickers), ticker))
+    fresh[i] = read_months(input_path)
+  logging.info('Read %d tickers, reused %d tickers'
+               % (len(fresh), len(reused)))
+
+  bounds = [m for months in fresh.values() for m in (min(months), max(months))
+            if months]
+  if reused:
+    bounds += [int(old.months[0]), int(old.months[-1])]
+  first = min(bounds) if bounds else 0
+  count = max(bounds) - first + 1 if bounds else 0
+  shape = (len(tickers), count)
+  dollar_volume = np.zeros(shape)
+  trading_days = np.zeros(shape, dtype=np.int32)
+  adjclose = np.full(shape, np.nan)
+  if reused:
+    rows = np.array([i for i, _ in reused])
+    old_rows = np.array([j for _, j in reused])
+    offset = int(old.months[0]) - first
+    columns = slice(offset, offset + len(old.months))
+    dollar_volume[rows, columns] = old.dollar_volume[old_rows]
+    trading_days[rows, columns] = old.trading_days[old_rows]
+    adjclose[rows, columns] = old.adjclose[old_rows]
+  for i, months in fresh.items():
+    for m, (dv, days, close) in months.items():
+      dollar_volume[i, m - first] = dv
+      trading_days[i, m - first] = days
+      adjclose[i, m - first] = close
+  old = None  # release the memory maps before overwriting
+
+  makedirs(cube_dir, exist_ok=True)
+  # The state is removed first and written last, so an interrupted build is
+  # redone in full.
+  if path.isfile('%s/state.txt' % cube_dir):
+    remove('%s/state.txt' % cube_dir)
+  with open('%s/tickers.txt' % cube_dir, 'w') as fp:
+    for ticker in tickers:
+      print(ticker, file=fp)
+  np.save('%s/months.npy' % cube_dir,
+          np.arange(first, first + count, dtype=np.int32))
+  np.save('%s/dollar_volume.npy' % cube_dir, dollar_volume)
+  np.save('%s/trading_days.npy' % cube_dir, trading_days)
+  np.save('%s/adjclose.npy' % cube_dir, adjclose)
+  with open('%s/state.txt' % cube_dir, 'w') as fp:
+    for ticker in tickers:
+      if ticker in state:
+        print('%s %s' % (ticker, state[ticker]), file=fp)
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--ticker_file', required=True)
+  parser.add_argument('--price_dir', required=True)
+  parser.add_argument('--cube_dir', required=True)
+  parser.add_argument('--verbose', action='store_true')
+  args = parser.parse_args()
+
+  utils.setup_logging(args.verbose)
+
+  # Tickers are listed one per line.
+  with open(args.ticker_file, 'r') as fp:
+    tickers = fp.read().splitlines()
+  logging.info('Processing %d tickers' % len(tickers))
+
+  build(tickers, args.price_dir, args.cube_dir)
+
+if __name__ == '__main__':
+  main()